@@ -0,0 +1,203 @@
+"""
+效能基準測試（不需要顯示器，可在命令列或 CI 執行）。
+
+產生 1 萬 / 10 萬 / 100 萬個字根碼的合成 word.tab，量測：
+- 詞庫冷啟動（解析 word.tab 並建立快取）與熱啟動（開啟既有快取），即 load_word_tab 的兩條路徑；
+- find_word_matches 與 find_word_matches_with_vr 每秒可查詢的次數；
+- 歷史紀錄持續成長時，每次 add_to_history（日誌附加與搜尋索引更新）的平均成本。
+
+用法：
+    python benchmarks/bench_ime.py                     # 執行並與 baseline.json 比較
+    python benchmarks/bench_ime.py --sizes 10000       # 只跑 1 萬個字根碼
+    python benchmarks/bench_ime.py --save-baseline     # 把這次的結果存成新的基準
+
+所有數值都是「越小越好」的秒數；比基準慢超過容許比例（預設 50%，單次量測的誤差約 ±25%）就視為退步，結束代碼為 1。
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clipboard_history import ClipboardHistory  # noqa: E402
+from history_search import HistorySearchIndex  # noqa: E402
+from latency import LatencyRecorder  # noqa: E402
+from persistence import PersistenceService  # noqa: E402
+from word_table import open_word_table  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+HISTORY_SIZES = (1_000, 10_000, 100_000)
+CODE_CHARS = "abcdefghijklmnopqrstuvwxyz"
+CJK_CHARS = [chr(c) for c in range(0x4E00, 0x4E00 + 6000)]
+
+
+def generate_word_tab(path, code_count, seed=0):
+    """產生有 code_count 個不重複字根碼的 word.tab，回傳字根碼清單"""
+    rng = random.Random(seed)
+    codes = set()
+    while len(codes) < code_count:
+        length = rng.choice((2, 3, 3, 4, 4, 4, 5, 5, 6))
+        codes.add("".join(rng.choice(CODE_CHARS) for _ in range(length)))
+    codes = sorted(codes)
+    with open(path, "w", encoding="utf-8") as f:
+        for code in codes:
+            words = ("".join(rng.choice(CJK_CHARS) for _ in range(rng.choice((1, 1, 2, 2, 3, 4))))
+                     for _ in range(rng.choice((1, 1, 2, 3, 5, 8))))
+            f.write(f"{code} {' '.join(words)}\n")
+    return codes
+
+
+def load_app_lookup(table):
+    """
+    以主程式的查詢方法（不建立 Tk 視窗）量測 find_word_matches / find_word_matches_with_vr。
+    主程式無法匯入時（例如缺少 tkinter）回傳 None，略過這兩項。
+    """
+    try:
+        from chinese_ime_with_clipboard import ClipboardApp
+    except ImportError as e:
+        print(f"略過主程式查詢量測：{e}")
+        return None
+    app = SimpleNamespace(
+        word_dictionary=table,
+        vr_candidate_mode=SimpleNamespace(get=lambda: True),
+        latency=LatencyRecorder(),
+    )
+    app.find_word_matches = lambda code: ClipboardApp.find_word_matches(app, code)
+    return (app.find_word_matches,
+            lambda code: ClipboardApp.find_word_matches_with_vr(app, code))
+
+
+def time_per_call(func, args, repeat=3):
+    """對每個參數呼叫一次 func，取 repeat 輪中最快的一輪，回傳每次呼叫的平均秒數"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for arg in args:
+            func(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(args)
+
+
+def bench_word_table(workdir, size, results):
+    word_tab = os.path.join(workdir, f"word_{size}.tab")
+    cache = word_tab + ".cache"
+    codes = generate_word_tab(word_tab, size)
+
+    start = time.perf_counter()
+    table, _ = open_word_table(word_tab, cache)
+    results[f"word_table/{size}/cold_load_s"] = time.perf_counter() - start
+    table.close()
+
+    start = time.perf_counter()
+    table, _ = open_word_table(word_tab, cache)
+    results[f"word_table/{size}/warm_load_s"] = time.perf_counter() - start
+
+    lookups = load_app_lookup(table)
+    if lookups is not None:
+        find_word_matches, find_word_matches_with_vr = lookups
+        rng = random.Random(1)
+        probes = [rng.choice(codes) for _ in range(20_000)]
+        shortcodes = [code + rng.choice("VR") for code in probes if len(code) >= 3][:20_000]
+        misses = ["".join(rng.choice(CODE_CHARS) for _ in range(6)) + "q" for _ in range(5_000)]
+        results[f"word_table/{size}/find_word_matches_s"] = time_per_call(find_word_matches, probes)
+        results[f"word_table/{size}/find_word_matches_with_vr_s"] = time_per_call(
+            find_word_matches_with_vr, probes + shortcodes + misses)
+    table.close()
+
+
+def bench_history(workdir, results):
+    rng = random.Random(2)
+    store = PersistenceService()
+    for size in HISTORY_SIZES:
+        path = os.path.join(workdir, f"history_{size}.json")
+        history = ClipboardHistory(path, limit=size, store=store)
+        history.load()
+        index = HistorySearchIndex()
+        texts = ["".join(rng.choice(CJK_CHARS) for _ in range(rng.randint(2, 30))) + f" #{i}"
+                 for i in range(size + 1_000)]
+        for text in texts[:size]:
+            history.add(text)
+            index.add(text)
+
+        # 已經有 size 筆紀錄之後，再加入 1000 筆（每筆都會淘汰一筆最舊的紀錄）的平均成本
+        start = time.perf_counter()
+        for text in texts[size:]:
+            for old in history.add(text):
+                index.remove(old)
+            index.add(text)
+        results[f"history/{size}/add_to_history_s"] = (time.perf_counter() - start) / 1_000
+
+        start = time.perf_counter()
+        history.close()  # 包含等待背景壓縮寫完快照
+        results[f"history/{size}/save_s"] = time.perf_counter() - start
+    store.close()
+
+
+def compare(results, baseline, tolerance):
+    """回傳退步的項目 [(名稱, 基準, 目前)]"""
+    regressions = []
+    for name, value in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            status = "（無基準）"
+        elif value > base * (1 + tolerance):
+            status = f"退步 {value / base - 1:+.0%}"
+            regressions.append((name, base, value))
+        else:
+            status = f"{value / base - 1:+.0%}"
+        print(f"{name:<52}{value * 1e6:>14.2f} µs  {status}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="輸入法與剪貼簿歷史的效能基準測試")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="合成詞庫的字根碼數")
+    parser.add_argument("--skip-history", action="store_true", help="不量測歷史紀錄")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="基準檔路徑")
+    parser.add_argument("--save-baseline", action="store_true", help="把這次的結果存成新的基準")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="容許比基準慢的比例")
+    args = parser.parse_args(argv)
+
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="ime_bench_")
+    try:
+        for size in args.sizes:
+            print(f"量測 {size} 個字根碼的詞庫...")
+            bench_word_table(workdir, size, results)
+        if not args.skip_history:
+            print("量測歷史紀錄...")
+            bench_history(workdir, results)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"已儲存基準：{args.baseline}")
+        return 0
+    if regressions:
+        print(f"\n{len(regressions)} 項比基準慢超過 {args.tolerance:.0%}：")
+        for name, base, value in regressions:
+            print(f"  {name}: {base * 1e6:.2f} µs -> {value * 1e6:.2f} µs")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""
+候選詞使用次數統計（不依賴 Tk）。
+
+記錄每個字根碼下各候選詞被選取的次數，並依次數重新排序候選清單。
+次數只在記憶體中累加，由呼叫端分批寫回檔案，避免每次按鍵都寫檔。
+"""
+
+import json
+import os
+
+
+class CandidateUsage:
+    """以 {字根碼: {候選詞: 次數}} 保存選字次數；只有被選過的字根碼才會佔用空間"""
+
+    def __init__(self, path, flush_threshold=20):
+        self.path = path
+        self.flush_threshold = flush_threshold  # 累積多少筆未寫入的選取就該寫檔
+        self.counts = {}
+        self.pending = 0
+
+    def load(self):
+        """讀取統計檔；檔案不存在時從空白開始"""
+        if not os.path.exists(self.path):
+            self.counts = {}
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.counts = {code: {word: int(n) for word, n in words.items()} for code, words in data.items()}
+        self.pending = 0
+
+    def record(self, code, word):
+        """記錄一次選取，回傳是否已累積到該寫檔的數量"""
+        words = self.counts.setdefault(code, {})
+        words[word] = words.get(word, 0) + 1
+        self.pending += 1
+        return self.pending >= self.flush_threshold
+
+    def rank(self, code, words):
+        """依選取次數由多到少排序候選詞；次數相同時維持 word.tab 的原始順序"""
+        counts = self.counts.get(code)
+        if not counts:
+            return words
+        return sorted(words, key=lambda w: -counts.get(w, 0))
+
+    def to_json(self):
+        return json.dumps(self.counts, ensure_ascii=False, separators=(",", ":"))
+
+    def mark_flushed(self):
+        """目前的統計已交給呼叫端寫檔（例如 PersistenceService），重新累計未寫入的選取數"""
+        self.pending = 0
@@ -2,10 +2,24 @@
 
 import tkinter as tk
 from tkinter import ttk, messagebox, font
-import pyperclip
 import json
+import multiprocessing
 import os
-import pickle
+import queue
+import threading
+
+from candidate_usage import CandidateUsage
+from clipboard_backend import CLIPBOARD_BACKENDS, ClipboardBackend, ClipboardWatcher
+from clipboard_history import ClipboardHistory
+from composition_buffer import CompositionBuffer, make_composition_target
+from history_search import HistorySearchIndex, scan_texts
+from ime_daemon import DaemonClient, DaemonError, RemoteWordTable
+from ime_engine import apply_word_layers, lookup_code, lookup_codes, wildcard_candidates
+from latency import LatencyRecorder, timed
+from persistence import PersistenceService
+from word_table import (
+    CompiledWordTable, LayeredWordTable, is_wildcard_code, lookup_input_codes, open_word_table,
+)
 
 
 class ClipboardApp:
@@ -18,6 +32,7 @@ class ClipboardApp:
         self.history_file = "clipboard_history.json"
         self.word_tab_file = "word.tab"
         self.settings_file = "app_settings.json"
+        self.usage_file = "candidate_usage.json"
         
         # 模式控制變數初始化（必須在載入設定之前）
         self.is_chinese_mode = tk.BooleanVar(value=False)
@@ -25,21 +40,69 @@ class ClipboardApp:
         self.preselect_mode = tk.BooleanVar(value=False)
         self.vr_candidate_mode = tk.BooleanVar(value=False)
         
+        # 設定、歷史快照、選字統計都交給背景執行緒延後寫入（暫存檔 + 改名，不會寫壞檔案）
+        self.persistence = PersistenceService()
+        self.persistence_check_interval = 1000  # 毫秒，檢查背景寫檔是否發生錯誤的間隔
+
         # 載入設定
         self.load_settings()
         
         # 設定視窗位置和大小
         self.apply_window_settings()
+
+        # 輸入延遲統計（預設停用）
+        self.latency = LatencyRecorder(self.settings["latency_tracking"])
+        self.diagnostics_dialog = None
+
+        # 剪貼簿（預設使用 Tk 內建剪貼簿，不必每次複製都啟動子行程）
+        backend = self.settings["clipboard_backend"]
+        self.clipboard = ClipboardBackend(self.root, backend if backend in CLIPBOARD_BACKENDS else "auto")
+        self._clipboard_copy_job = None  # 延後複製（歷史清單快速點選）：(after 編號, 內容)
+        self.clipboard_watcher = ClipboardWatcher(
+            self.root, self.clipboard, self.on_external_copy,
+            max_interval=self.settings["clipboard_watch_max_interval"],
+            max_chars=self.settings["clipboard_watch_max_chars"])
         
-        # 載入歷史和詞彙
+        # 載入歷史（快照 + 附加式日誌）
+        self.history = ClipboardHistory(self.history_file, limit=self.settings["history_limit"],
+                                        store=self.persistence)
+        self.history_page_size = 100  # 歷史清單每次捲到底（或頂端）時多載入的筆數
+        self.history_window_rows = 500  # 清單中最多同時放入的筆數，超過時從另一端移除
+        self.history_rows_first = 0  # 清單第一列是第幾筆
+        self.history_rows_loaded = 0  # 清單目前放入的筆數
+        # 歷史搜尋：第一次搜尋時才在背景建立索引，建立期間的新增/刪除先記在 pending，建好後再補上
+        self.history_index = None
+        self._history_indexing = False
+        self._history_index_pending = []
+        self.history_search_results = None  # 搜尋中時顯示的結果（由新到舊）
+        self._history_query = ""
+        self.history_search_limit = 200
+        self.history_scan_limit = 5000  # 索引建好前只逐筆掃描最近這麼多筆，顯示部分結果
         self.load_history()
-        # *** 修改：初始化字典來儲存詞彙，而不是列表 ***
-        self.word_dictionary = {}
-        self.load_word_tab()
+        # *** 修改：詞庫改為以 mmap 開啟的編譯索引（介面與字典相同），並在背景執行緒載入 ***
+        self.word_dictionary = CompiledWordTable.from_dict({})
+        self.word_table_ready = False
+        self.pending_codes = []  # 詞庫載入完成前輸入的字根碼
+        self.background_poll_interval = 50  # 毫秒，輪詢背景工作結果的間隔
+        # 詞庫熱更新：上次載入時與上次輪詢時各檔案的 (大小, mtime_ns)
+        self._loaded_word_stamps = None
+        self._polled_word_stamps = None
+        self._word_tab_reloading = False
 
         # 中文輸入候選清單
         self.candidates = []
-        self.selection_dialog = None
+        self.current_code = ""  # 目前候選清單對應的字根碼
+        self.selection_dialog = None  # 顯示中的候選視窗；隱藏時為 None
+        self._candidate_window = None  # 共用的候選視窗（隱藏時仍保留）
+        self.candidate_window_matches = []
+        self.candidate_window_labels = None
+        self.candidate_page = 0  # 候選視窗目前顯示的頁數（從 0 起算）
+        self.candidate_page_size = 10  # 每頁 10 個，剛好對應數字鍵 0-9
+
+        # 選字次數統計（分批寫檔）
+        self.candidate_usage = CandidateUsage(self.usage_file)
+        self.usage_flush_interval = 30000  # 毫秒
+        self.load_candidate_usage()
 
         # 焦點追蹤
         self.focused_widget = None
@@ -49,6 +112,17 @@ class ClipboardApp:
         
         self.setup_ui()
         self.bind_events()
+        # 主輸入框的組字緩衝區：選字只在尾端附加或取代最後一段，不重寫整行
+        self.composition = CompositionBuffer(make_composition_target(self.entry))
+
+        # 視窗建立後才開始載入詞庫，避免冷快取時視窗遲遲不出現
+        self.start_word_tab_loading()
+        self.root.after(self.persistence_check_interval, self._check_persistence_errors)
+        if self.settings["word_tab_watch_interval"]:
+            self.root.after(self.settings["word_tab_watch_interval"], self._watch_word_tab)
+        self.root.after(self.usage_flush_interval, self._flush_usage_periodically)
+        if self.settings["clipboard_watch"]:
+            self.clipboard_watcher.start()
 
     def load_settings(self):
         """載入設定檔案"""
@@ -61,11 +135,42 @@ class ClipboardApp:
             "font_family": "Arial",
             # 新增候選視窗設定
             "candidate_window_width": 300,
-            "candidate_window_height": 200,
+            "candidate_window_height": 260,
             "candidate_font_size": 12,
             "candidate_font_family": "Arial",
             # 新增VR候選簡碼設定
-            "vr_candidate_mode": False
+            "vr_candidate_mode": False,
+            # 候選簡碼的選字尾碼：{尾碼: 第幾個候選詞}，預設 V 選第二個、R 選第三個
+            "selector_suffixes": {"V": 2, "R": 3},
+            # 輸入時即時預覽的候選數量
+            "preview_candidate_count": 8,
+            # 疊在系統詞庫(word.tab)之上的使用者詞庫與覆寫/黑名單檔
+            "user_word_tab_file": "user_word.tab",
+            "override_word_tab_file": "word_override.tab",
+            # 依選字次數調整候選順序
+            "adaptive_candidate_order": True,
+            # 萬用字元(? *)查詢最多列出的字根碼數
+            "wildcard_result_limit": 50,
+            # 大型 word.tab 平行解析使用的行程數（0 表示依 CPU 核心數）
+            "parse_workers": 0,
+            # 檢查 word.tab 等詞庫檔案是否更新的間隔（毫秒，0 表示停用熱更新）
+            "word_tab_watch_interval": 2000,
+            # 共用詞庫服務（ime_daemon.py）的 socket 路徑；空字串表示不使用，直接在本機載入詞庫
+            "dictionary_daemon_socket": "",
+            # 歷史紀錄最多保留的筆數（0 表示不限制），超過時淘汰最久沒用到的紀錄
+            "history_limit": 10000,
+            # 記錄各階段的輸入延遲（效能診斷用），以及統計檔的位置
+            "latency_tracking": False,
+            "latency_stats_file": "latency_stats.json",
+            # 剪貼簿寫入方式：auto/tk 使用 Tk 內建剪貼簿，pyperclip 在背景執行緒呼叫 pyperclip
+            "clipboard_backend": "auto",
+            # 在歷史清單快速點選時，停止點選多久（毫秒）後才複製最後選到的那一筆
+            "clipboard_debounce_ms": 150,
+            # 監看其他程式複製的內容並加入歷史紀錄；閒置時檢查間隔逐漸拉長到上限（毫秒），
+            # 超過字元數上限的內容不加入
+            "clipboard_watch": False,
+            "clipboard_watch_max_interval": 4000,
+            "clipboard_watch_max_chars": 100000
         }
         
         if os.path.exists(self.settings_file):
@@ -94,8 +199,8 @@ class ClipboardApp:
             # 儲存VR候選簡碼設定
             self.settings["vr_candidate_mode"] = self.vr_candidate_mode.get()
             
-            with open(self.settings_file, "w", encoding="utf-8") as f:
-                json.dump(self.settings, f, ensure_ascii=False, indent=2)
+            # *** 修改：在 Tk 執行緒序列化，實際寫檔交給背景執行緒 ***
+            self.persistence.write(self.settings_file, json.dumps(self.settings, ensure_ascii=False, indent=2))
         except Exception as e:
             messagebox.showerror("錯誤", f"儲存設定檔案失敗: {e}")
 
@@ -117,25 +222,37 @@ class ClipboardApp:
             
         self.root.geometry(f"{width}x{height}+{x}+{y}")
 
-    def setup_fonts(self):
-        """設定字型"""
+    def font_specs(self):
+        """各用途字型的設定：{屬性名稱: (字型, 大小, 粗細)}"""
         font_size = self.settings["font_size"]
         font_family = self.settings["font_family"]
         
-        self.default_font = font.Font(family=font_family, size=font_size)
-        self.entry_font = font.Font(family=font_family, size=font_size + 2)
-        self.button_font = font.Font(family=font_family, size=font_size - 1)
-        self.label_font = font.Font(family=font_family, size=font_size)
-        self.title_font = font.Font(family=font_family, size=font_size + 1, weight="bold")
-        
-        # 設定候選視窗字型
+        # 候選視窗字型
         candidate_font_size = self.settings["candidate_font_size"]
         candidate_font_family = self.settings["candidate_font_family"]
         
-        self.candidate_default_font = font.Font(family=candidate_font_family, size=candidate_font_size)
-        self.candidate_button_font = font.Font(family=candidate_font_family, size=candidate_font_size - 1)
-        self.candidate_label_font = font.Font(family=candidate_font_family, size=candidate_font_size)
-        self.candidate_title_font = font.Font(family=candidate_font_family, size=candidate_font_size + 1, weight="bold")
+        return {
+            "default_font": (font_family, font_size, "normal"),
+            "entry_font": (font_family, font_size + 2, "normal"),
+            "button_font": (font_family, font_size - 1, "normal"),
+            "label_font": (font_family, font_size, "normal"),
+            "title_font": (font_family, font_size + 1, "bold"),
+            "candidate_default_font": (candidate_font_family, candidate_font_size, "normal"),
+            "candidate_button_font": (candidate_font_family, candidate_font_size - 1, "normal"),
+            "candidate_label_font": (candidate_font_family, candidate_font_size, "normal"),
+            "candidate_title_font": (candidate_font_family, candidate_font_size + 1, "bold"),
+        }
+
+    # *** 修改：每種用途只有一個具名字型，元件以參照共用；變更設定時就地 configure，不必逐一更新元件 ***
+    def setup_fonts(self):
+        """設定字型：第一次呼叫時建立具名字型，之後只更新字型內容"""
+        for attr, (family, size, weight) in self.font_specs().items():
+            font_obj = getattr(self, attr, None)
+            if font_obj is None:
+                font_obj = font.Font(root=self.root, name=f"ime_{attr}", family=family, size=size, weight=weight)
+                setattr(self, attr, font_obj)
+            else:
+                font_obj.configure(family=family, size=size, weight=weight)
 
     def calculate_window_size(self):
         """根據字型大小計算視窗大小"""
@@ -214,6 +331,7 @@ class ClipboardApp:
         if self.focused_widget == event.widget:
             self.focused_widget = None
 
+    @timed("key_press")
     def on_chinese_key_press(self, event):
         """處理中文輸入框的按鍵事件"""
         char = event.char
@@ -221,53 +339,22 @@ class ClipboardApp:
         # 檢查是否為數字且候選視窗未開啟
         if char.isdigit() and not self.is_candidate_window_open():
             # 將數字填入主輸入框
-            current_main_text = self.entry.get()
-            self.entry.delete(0, tk.END)
-            self.entry.insert(0, current_main_text + char)
+            self.composition.commit(char)
             return "break"  # 阻止預設行為
         
         # 其他字元維持原有行為
         return None
 
+    @timed("lookup")
     def find_word_matches_with_vr(self, input_code):
         """搜尋詞語匹配，支援VR候選簡碼作為後備機制"""
-        # 如果VR候選簡碼模式未啟用，直接使用原始搜尋
-        if not self.vr_candidate_mode.get():
-            return self.find_word_matches(input_code)
-        
-        # 1. 先嘗試exact match（優先級最高）
-        exact_matches = self.find_word_matches(input_code)
-        if exact_matches:  # 如果有exact match，直接返回
-            return exact_matches
-        
-        # 2. 如果沒有exact match，且啟用VR模式，則檢查是否為VR簡碼格式
-        is_v_shortcode = False
-        is_r_shortcode = False
-        base_code = ""
-        
-        # 檢查V候選簡碼 (3碼+V/v 或 4碼+V/v)
-        if len(input_code) >= 4 and input_code[-1].upper() == 'V':
-            is_v_shortcode = True
-            base_code = input_code[:-1]  # 移除最後的V/v
-        
-        # 檢查R候選簡碼 (3碼+R/r 或 4碼+R/r)  
-        elif len(input_code) >= 4 and input_code[-1].upper() == 'R':
-            is_r_shortcode = True
-            base_code = input_code[:-1]  # 移除最後的R/r
-        
-        # 3. 如果是VR候選簡碼格式，尋找base_code的候選詞
-        if is_v_shortcode or is_r_shortcode:
-            base_matches = self.find_word_matches(base_code)
-            
-            if is_v_shortcode and len(base_matches) > 1:
-                # V代表第二個候選(索引1)
-                return [base_matches[1]]
-            elif is_r_shortcode and len(base_matches) > 2:
-                # R代表第三個候選(索引2)
-                return [base_matches[2]]
-        
-        # 4. 如果以上都沒有找到，返回空列表
-        return []
+        # *** 修改：查詢邏輯移到不依賴介面的 ime_engine，與批次轉換工具共用 ***
+        # 完全匹配優先；啟用VR模式且沒有完全匹配時，才把輸入當作候選簡碼（三碼以上 + 選字尾碼）
+        return lookup_code(self.word_dictionary, input_code, self.vr_candidate_mode.get())
+
+    def selector_positions(self):
+        """將設定中的選字尾碼 {尾碼: 第幾個候選詞(從 1 起算)} 轉成詞庫使用的 0 起算位置"""
+        return {suffix: int(n) - 1 for suffix, n in self.settings["selector_suffixes"].items()}
 
     def open_settings_dialog(self):
         """開啟設定對話框"""
@@ -301,11 +388,28 @@ class ClipboardApp:
                                   font=self.label_font)
         vr_check.pack(anchor="w", padx=5, pady=2)
         
-        # VR候選簡碼說明（更新說明）
-        vr_info = tk.Label(feature_frame, text="• 找不到完全匹配時的後備機制\n• 三碼+V/v 或 四碼+V/v：選擇第二個候選詞\n• 三碼+R/r 或 四碼+R/r：選擇第三個候選詞", 
+        # VR候選簡碼說明（依設定檔中的選字尾碼產生）
+        selector_lines = "".join(
+            f"\n• 三碼以上+{suffix}/{suffix.lower()}：選擇第 {n} 個候選詞"
+            for suffix, n in sorted(self.settings["selector_suffixes"].items(), key=lambda item: item[1]))
+        vr_info = tk.Label(feature_frame, text="• 找不到完全匹配時的後備機制" + selector_lines, 
                           font=self.label_font, fg="gray", justify="left")
         vr_info.pack(anchor="w", padx=20, pady=2)
 
+        # 輸入延遲統計
+        latency_frame = tk.Frame(feature_frame)
+        latency_frame.pack(anchor="w", padx=5, pady=2)
+        latency_var = tk.BooleanVar(value=self.latency.enabled)
+        tk.Checkbutton(latency_frame, text="記錄輸入延遲", variable=latency_var,
+                       font=self.label_font).pack(side=tk.LEFT)
+        tk.Button(latency_frame, text="效能診斷", font=self.button_font,
+                  command=self.open_diagnostics_dialog).pack(side=tk.LEFT, padx=5)
+
+        # 監看其他程式複製的內容
+        clipboard_watch_var = tk.BooleanVar(value=self.settings["clipboard_watch"])
+        tk.Checkbutton(feature_frame, text="將其他程式複製的文字加入歷史紀錄", variable=clipboard_watch_var,
+                       font=self.label_font).pack(anchor="w", padx=5, pady=2)
+
         # === 主視窗設定 ===
         main_frame = tk.LabelFrame(scrollable_frame, text="主視窗設定", font=self.title_font)
         main_frame.pack(pady=5, padx=10, fill="x")
@@ -418,13 +522,17 @@ class ClipboardApp:
                 self.settings["candidate_window_height"] = new_candidate_height
                 # 更新VR候選簡碼設定
                 self.vr_candidate_mode.set(vr_candidate_var.get())
+                self.settings["latency_tracking"] = latency_var.get()
+                self.latency.enabled = latency_var.get()
+                self.settings["clipboard_watch"] = clipboard_watch_var.get()
+                if clipboard_watch_var.get():
+                    self.clipboard_watcher.start()
+                else:
+                    self.clipboard_watcher.stop()
 
-                # 重新設定字型
+                # 重新設定字型（所有使用這些字型的元件會自動更新）
                 self.setup_fonts()
                 
-                # 更新所有UI元件的字型
-                self.update_all_fonts()
-                
                 # 更新視窗大小和位置
                 self.update_window_size()
                 self.apply_window_settings()
@@ -468,6 +576,58 @@ class ClipboardApp:
             canvas.yview_scroll(int(-1*(event.delta/120)), "units")
         canvas.bind("<MouseWheel>", _on_mousewheel)
 
+    def open_reverse_lookup_dialog(self):
+        """開啟反查視窗：輸入字或詞，列出它的字根碼與VR候選簡碼"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("反查字根")
+        dialog.geometry("360x200")
+        dialog.transient(self.root)
+        dialog.resizable(False, False)
+
+        input_frame = tk.Frame(dialog)
+        input_frame.pack(pady=10)
+        tk.Label(input_frame, text="字詞:", font=self.label_font).pack(side=tk.LEFT)
+        word_var = tk.StringVar()
+        word_entry = tk.Entry(input_frame, textvariable=word_var, width=16, font=self.entry_font)
+        word_entry.pack(side=tk.LEFT, padx=5)
+
+        result_label = tk.Label(dialog, text="", font=self.label_font, justify="left", anchor="w", wraplength=330)
+        result_label.pack(fill="x", padx=10)
+
+        def show_result(result, error):
+            if not result_label.winfo_exists():
+                return
+            if error is not None:
+                result_label.config(text=f"反查失敗: {error}")
+                return
+            word, codes, shortcodes = result
+            if not codes:
+                result_label.config(text=f"詞庫中沒有「{word}」")
+                return
+            text = f"字根碼: {', '.join(codes)}"
+            if shortcodes:
+                text += f"\nVR簡碼: {', '.join(shortcodes)}"
+            result_label.config(text=text)
+
+        def lookup(event=None):
+            word = word_var.get().strip()
+            if not word:
+                return
+            if not self.word_table_ready:
+                result_label.config(text="詞庫載入中，請稍候再試")
+                return
+            # 第一次反查需要建立索引，放到背景執行緒以免卡住介面
+            table = self.word_dictionary
+            vr_mode = self.vr_candidate_mode.get()
+            result_label.config(text="查詢中...")
+            self.run_in_background(lambda: (word, *lookup_input_codes(table, word, vr_mode)), show_result)
+
+        tk.Button(input_frame, text="查詢", font=self.button_font, command=lookup).pack(side=tk.LEFT)
+        tk.Button(dialog, text="關閉", font=self.button_font, command=dialog.destroy).pack(side=tk.BOTTOM, pady=10)
+        word_entry.bind("<Return>", lookup)
+        dialog.bind("<Escape>", lambda e: dialog.destroy())
+        word_entry.focus_set()
+
     def show_font_preview(self, font_family, font_size, title, parent_window):
         """顯示字型預覽視窗"""
         try:
@@ -578,45 +738,6 @@ class ClipboardApp:
         x_var.set(str(x))
         y_var.set(str(y))
 
-    def update_all_fonts(self):
-        """更新所有UI元件的字型"""
-        def update_widget_font(widget, font_obj):
-            try:
-                widget.configure(font=font_obj)
-            except:
-                pass
-
-        # 更新主視窗中的所有元件
-        self.mode_label.configure(font=self.title_font)
-        self.entry.configure(font=self.entry_font)
-        self.chinese_entry.configure(font=self.entry_font)
-        self.history_label.configure(font=self.title_font)
-        self.history_listbox.configure(font=self.default_font)
-
-        # 更新所有標籤
-        for widget in self.root.winfo_children():
-            self.update_widget_fonts_recursive(widget)
-
-    def update_widget_fonts_recursive(self, widget):
-        """遞歸更新widget及其子元件的字型"""
-        widget_class = widget.winfo_class()
-        
-        if widget_class == "Label":
-            widget.configure(font=self.label_font)
-        elif widget_class == "Button":
-            widget.configure(font=self.button_font)
-        elif widget_class == "Entry":
-            if widget == self.entry or widget == self.chinese_entry:
-                widget.configure(font=self.entry_font)
-            else:
-                widget.configure(font=self.default_font)
-        elif widget_class == "Listbox":
-            widget.configure(font=self.default_font)
-        
-        # 遞歸處理子元件
-        for child in widget.winfo_children():
-            self.update_widget_fonts_recursive(child)
-
     def setup_ui(self):
         # 模式切換區域
         self.mode_frame = tk.Frame(self.root)
@@ -659,9 +780,12 @@ class ClipboardApp:
         self.chinese_entry = tk.Entry(self.chinese_frame, font=self.entry_font, width=30)
         self.chinese_entry.pack(pady=2)
 
-        # 候選清單
+        # 候選清單（輸入時即時預覽以目前字根開頭的候選詞）
         self.candidate_frame = tk.Frame(self.chinese_frame)
         self.candidate_frame.pack(pady=2)
+        self.preview_label = tk.Label(self.candidate_frame, text="", font=self.label_font,
+                                      fg="gray", justify="left", anchor="w")
+        self.preview_label.pack(fill="x")
 
         # 按鈕區域
         self.button_frame = tk.Frame(self.root)
@@ -674,16 +798,23 @@ class ClipboardApp:
                  command=self.clear_history).pack(side=tk.LEFT, padx=2)
         tk.Button(self.button_frame, text="設定", font=self.button_font, 
                  command=self.open_settings_dialog).pack(side=tk.LEFT, padx=2)
+        tk.Button(self.button_frame, text="反查字根", font=self.button_font, 
+                 command=self.open_reverse_lookup_dialog).pack(side=tk.LEFT, padx=2)
 
         # 歷史紀錄
-        self.history_label = tk.Label(self.root, text="歷史紀錄", font=self.title_font)
-        self.history_label.pack(pady=5)
-        self.history_listbox = tk.Listbox(self.root, width=50, height=8, font=self.default_font)
+        history_header = tk.Frame(self.root)
+        history_header.pack(pady=5)
+        self.history_label = tk.Label(history_header, text="歷史紀錄", font=self.title_font)
+        self.history_label.pack(side=tk.LEFT)
+        tk.Label(history_header, text="搜尋:", font=self.label_font).pack(side=tk.LEFT, padx=(10, 2))
+        self.history_search_entry = tk.Entry(history_header, font=self.default_font, width=20)
+        self.history_search_entry.pack(side=tk.LEFT)
+        self.history_listbox = tk.Listbox(self.root, width=50, height=8, font=self.default_font,
+                                          yscrollcommand=self.on_history_scrolled)
         self.history_listbox.pack()
 
-        # 載入歷史
-        for item in self.history:
-            self.history_listbox.insert(tk.END, item)
+        # *** 修改：最新的紀錄排在最上面，只先放入第一頁，捲到底時再載入下一頁 ***
+        self.render_history()
 
     def bind_events(self):
         # 主輸入框事件
@@ -707,6 +838,11 @@ class ClipboardApp:
         # 英文字母與標點處理（只在先上字模式下啟用）
         self.root.bind("<Key>", self.handle_letter_input)
 
+        # 歷史搜尋（邊輸入邊篩選）
+        self.history_search_entry.bind("<KeyRelease>", self.on_history_search)
+        self.history_search_entry.bind("<FocusIn>", self.on_focus_in)
+        self.history_search_entry.bind("<FocusOut>", self.on_focus_out)
+
         # 歷史選擇事件
         self.history_listbox.bind("<<ListboxSelect>>", self.on_history_select)
         self.history_listbox.bind("<FocusIn>", self.on_focus_in)
@@ -724,14 +860,25 @@ class ClipboardApp:
         if self.hotkey_var.get() == hotkey:
             self.toggle_mode()
 
+    def update_mode_label(self):
+        """依目前模式與詞庫載入狀態更新模式標籤"""
+        if self.is_chinese_mode.get():
+            text, color = "中文", "red"
+        else:
+            text, color = "英文", "blue"
+        if not self.word_table_ready:
+            text += " (詞庫載入中...)"
+            if self.pending_codes:
+                text += f" 已暫存{len(self.pending_codes)}組字根"
+        self.mode_label.config(text=text, fg=color)
+
     def toggle_mode(self):
         self.is_chinese_mode.set(not self.is_chinese_mode.get())
+        self.update_mode_label()
         if self.is_chinese_mode.get():
-            self.mode_label.config(text="中文", fg="red")
             self.chinese_frame.pack(after=self.main_frame, pady=5)
             self.chinese_entry.focus()
         else:
-            self.mode_label.config(text="英文", fg="blue")
             self.chinese_frame.pack_forget()
             self.entry.focus()
         self.clear_candidates()
@@ -741,52 +888,99 @@ class ClipboardApp:
         current_text = self.chinese_entry.get()
         if len(current_text) > 6:
             self.chinese_entry.delete(6, tk.END)
+            current_text = current_text[:6]
         self.clear_candidates()
         self.candidates = []
+        self.show_candidate_preview(current_text.strip())
+
+    def show_candidate_preview(self, prefix):
+        """在候選清單區顯示以 prefix 開頭的前 N 個字根碼及其候選詞"""
+        if not prefix or not self.word_table_ready:
+            return
+        limit = self.settings["preview_candidate_count"]
+        if is_wildcard_code(prefix):
+            items = self.word_dictionary.wildcard_items(prefix, limit)
+        else:
+            items = self.word_dictionary.prefix_items(prefix, limit)
+        lines = []
+        for code, words in items:
+            shown = " ".join(words[:5])
+            if len(words) > 5:
+                shown += " ..."
+            lines.append(f"{code}: {shown}")
+        self.preview_label.config(text="\n".join(lines))
 
     def on_chinese_space(self, event):
         input_text = self.chinese_entry.get().strip()
         if not input_text:
             return "break"
 
-        # 使用支援VR候選簡碼的搜尋方法
-        matches = self.find_word_matches_with_vr(input_text)
-        
-        if len(matches) == 1:
-            current_text = self.entry.get()
-            self.entry.delete(0, tk.END)
-            self.entry.insert(0, current_text + matches[0])
-        elif len(matches) > 1:
-            if self.preselect_mode.get():
-                current_text = self.entry.get()
-                self.entry.delete(0, tk.END)
-                self.entry.insert(0, current_text + matches[0])
-                self.candidates = matches
-                self.show_selection_dialog(matches)
+        # 詞庫尚未載入完成：先暫存字根碼，載入完成後再依序處理
+        if not self.word_table_ready:
+            self.pending_codes.append(input_text)
+            self.update_mode_label()
+            self.chinese_entry.delete(0, tk.END)
+            return "break"
+
+        # 只量測查詢與提交；找不到時的提示視窗會等使用者關閉，不計入延遲
+        with self.latency.measure("space"):
+            labels = None
+            if is_wildcard_code(input_text):
+                # 萬用字元查詢：由索引取出符合的字根碼，候選詞旁標示各自的字根碼
+                matches, labels = self.find_wildcard_matches(input_text)
+                self.current_code = ""  # 候選詞來自不同的字根碼，不計入選字次數
             else:
-                self.candidates = matches
-                self.show_selection_dialog(matches)
-        else:
-            messagebox.showinfo("提示", f"找不到 '{input_text}' 對應的詞語")
+                # 使用支援VR候選簡碼的搜尋方法
+                matches = self.find_word_matches_with_vr(input_text)
+
+            if len(matches) == 1:
+                self.composition.commit(matches[0])
+            elif len(matches) > 1:
+                if labels is None:
+                    # 依選字次數排序，常用的詞排在前面（先上字模式也會先上最常用的詞）
+                    matches = self.rank_candidates(input_text, matches)
+                    self.current_code = input_text
+                if self.preselect_mode.get():
+                    # 先上字：先提交第一個候選詞，選了其他候選詞時再取代這一段
+                    self.composition.commit(matches[0])
+                    self.candidates = matches
+                    self.show_selection_dialog(matches, labels)
+                else:
+                    self.candidates = matches
+                    self.show_selection_dialog(matches, labels)
+            self.chinese_entry.delete(0, tk.END)
 
-        self.chinese_entry.delete(0, tk.END)
+        if not matches:
+            messagebox.showinfo("提示", f"找不到 '{input_text}' 對應的詞語")
         return "break"
 
-    # *** 修改：使用字典進行高效查詢 ***
+    # *** 修改：使用編譯索引進行二分搜尋 ***
     def find_word_matches(self, input_code):
         """
         (重構後) 原始的詞語搜尋方法。
-        現在使用字典進行快速查找，而不是遍歷列表。
+        現在在 mmap 的已排序索引上二分搜尋，只解碼命中字根碼的候選詞；
+        有使用者詞庫或覆寫層時，回傳的是預先合併、去重後的候選清單。
         """
         # 使用 .get() 方法，如果找不到鍵，就返回一個空列表
         return self.word_dictionary.get(input_code, [])
 
-    def show_selection_dialog(self, matches):
+    def find_wildcard_matches(self, pattern):
+        """
+        以萬用字元索引查詢（? 代表任一字根，* 代表任意多個字根），結果依字根碼排序且有數量上限。
+        回傳 (候選詞清單, 顯示用標籤清單)。
+        """
+        return wildcard_candidates(self.word_dictionary, pattern, self.settings["wildcard_result_limit"])
+
+    # *** 修改：候選視窗整個執行期間只建立一次，之後以 withdraw/deiconify 隱藏與顯示並就地更新內容 ***
+    @timed("show_candidates")
+    def show_selection_dialog(self, matches, labels=None):
         self.close_selection_dialog()
-        
-        dialog = tk.Toplevel(self.root)
-        dialog.title("選擇詞語")
-        
+
+        dialog = self.get_candidate_window()
+        self.candidate_window_matches = matches
+        self.candidate_window_labels = labels
+        self.show_candidate_page(0)
+
         # 使用設定中的候選視窗大小
         width = self.settings["candidate_window_width"]
         height = self.settings["candidate_window_height"]
@@ -795,107 +989,136 @@ class ClipboardApp:
         x, y = self.get_candidate_window_position()
         
         dialog.geometry(f"{width}x{height}+{x}+{y}")
-        dialog.transient(self.root)
+        dialog.deiconify()
+        dialog.lift()
         dialog.grab_set()
         dialog.focus_force()
-        dialog.resizable(False, False)
 
         self.selection_dialog = dialog
         self.chinese_entry.config(state=tk.DISABLED)
 
-        def on_close():
-            self.chinese_entry.config(state=tk.NORMAL)
-            self.chinese_entry.delete(0, tk.END)
-            self.chinese_entry.focus()
-            self.close_selection_dialog()
+    def get_candidate_window(self):
+        """取得共用的候選視窗；第一次使用時才建立，之後只隱藏不銷毀"""
+        dialog = self._candidate_window
+        if dialog is not None and dialog.winfo_exists():
+            return dialog
 
-        dialog.protocol("WM_DELETE_WINDOW", on_close)
+        dialog = tk.Toplevel(self.root)
+        dialog.withdraw()
+        dialog.title("選擇詞語")
+        dialog.transient(self.root)
+        dialog.resizable(False, False)
+        dialog.protocol("WM_DELETE_WINDOW", self.cancel_candidate_window)
 
         # 使用候選視窗專用字型
         tk.Label(dialog, text="請選擇詞語:", font=self.candidate_title_font).pack(pady=5)
 
-        listbox = tk.Listbox(dialog, height=8, font=self.candidate_default_font)
+        listbox = tk.Listbox(dialog, height=self.candidate_page_size, font=self.candidate_default_font)
         listbox.pack(pady=5, padx=10, fill=tk.BOTH, expand=True)
+        listbox.bind("<Double-Button-1>", lambda e: self.choose_candidate_from_list())
+        self.candidate_listbox = listbox
 
-        for i, word in enumerate(matches):
-            listbox.insert(tk.END, f"{i}: {word}")
-
-        def on_select():
-            selection = listbox.curselection()
-            if selection:
-                selected_word = matches[selection[0]]
-                if self.preselect_mode.get():
-                    current_text = self.entry.get()
-                    if current_text and len(matches) > 0:
-                        first_word = matches[0]
-                        if current_text.endswith(first_word):
-                            current_text = current_text[:-len(first_word)]
-                    self.entry.delete(0, tk.END)
-                    self.entry.insert(0, current_text + selected_word)
-                else:
-                    current_text = self.entry.get()
-                    self.entry.delete(0, tk.END)
-                    self.entry.insert(0, current_text + selected_word)
-            on_close()
-
-        def on_double_click(event):
-            on_select()
-
-        listbox.bind("<Double-Button-1>", on_double_click)
+        # 候選詞超過一頁時顯示頁數
+        self.candidate_page_label = tk.Label(dialog, text="", font=self.candidate_label_font, fg="gray")
+        self.candidate_page_label.pack()
 
         button_frame = tk.Frame(dialog)
         button_frame.pack(pady=5)
 
-        tk.Button(button_frame, text="確定", font=self.candidate_button_font, command=on_select).pack(side=tk.LEFT, padx=5)
-        tk.Button(button_frame, text="取消", font=self.candidate_button_font, command=on_close).pack(side=tk.LEFT, padx=5)
-
-        def key_handler(num):
-            def handler(e=None):
-                if num < len(matches):
-                    selected_word = matches[num]
-                    if self.preselect_mode.get():
-                        current_text = self.entry.get()
-                        if current_text and len(matches) > 0:
-                            first_word = matches[0]
-                            if current_text.endswith(first_word):
-                                current_text = current_text[:-len(first_word)]
-                        self.entry.delete(0, tk.END)
-                        self.entry.insert(0, current_text + selected_word)
-                    else:
-                        current_text = self.entry.get()
-                        self.entry.delete(0, tk.END)
-                        self.entry.insert(0, current_text + selected_word)
-                on_close()
-            return handler
+        tk.Button(button_frame, text="確定", font=self.candidate_button_font,
+                  command=self.choose_candidate_from_list).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="取消", font=self.candidate_button_font,
+                  command=self.cancel_candidate_window).pack(side=tk.LEFT, padx=5)
 
+        # 數字鍵選取目前這一頁的候選詞
         for i in range(10):
-            dialog.bind(str(i), key_handler(i))
+            dialog.bind(str(i), lambda e, num=i: self.choose_candidate(self.candidate_page_start() + num))
 
-        dialog.bind("<Escape>", lambda e: on_close())
+        # 換頁；- 與 = 綁定的是特定按鍵，優先於下面先上字模式的 <Key> 處理
+        for key, step in (("<Prior>", -1), ("<Next>", 1), ("<Key-minus>", -1), ("<Key-equal>", 1)):
+            dialog.bind(key, lambda e, step=step: self.show_candidate_page(self.candidate_page + step))
 
-        def handle_new_input(event):
-            if not self.preselect_mode.get():
-                return
-            
-            char = event.char
-            allowed_chars = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ!@#$%^&*()-_=+`~[]{}|;:,.<>?/\\""'
-            
-            if char and char != ' ' and char in allowed_chars:
-                self.close_selection_dialog()
-                self.chinese_entry.config(state=tk.NORMAL)
-                self.chinese_entry.delete(0, tk.END)
-                self.chinese_entry.insert(0, char)
-                self.chinese_entry.focus()
-                self.clear_candidates()
-                return "break"
+        dialog.bind("<Escape>", lambda e: self.cancel_candidate_window())
+        dialog.bind("<Key>", self.on_candidate_window_key)
+
+        self._candidate_window = dialog
+        return dialog
+
+    def candidate_page_start(self):
+        return self.candidate_page * self.candidate_page_size
+
+    def show_candidate_page(self, page):
+        """
+        只把第 page 頁的候選詞放進清單；上千個候選詞的字根碼也只需要顯示 10 筆，
+        其他頁等換頁時才產生。超出範圍的頁數會被限制在第一頁與最後一頁之間。
+        """
+        shown = self.candidate_window_labels or self.candidate_window_matches
+        size = self.candidate_page_size
+        page_count = max(1, (len(shown) + size - 1) // size)
+        self.candidate_page = min(max(page, 0), page_count - 1)
+
+        start = self.candidate_page_start()
+        listbox = self.candidate_listbox
+        listbox.delete(0, tk.END)
+        listbox.insert(tk.END, *(f"{i}: {word}" for i, word in enumerate(shown[start:start + size])))
+
+        if page_count > 1:
+            self.candidate_page_label.config(
+                text=f"第 {self.candidate_page + 1}/{page_count} 頁（PgUp/PgDn 或 -/= 換頁）")
+        else:
+            self.candidate_page_label.config(text="")
+        return "break"
+
+    def cancel_candidate_window(self):
+        """關閉候選視窗並回到中文輸入框"""
+        self.current_code = ""  # 沒有選字就關閉時，不要把之後的選字算到這個字根碼
+        self.chinese_entry.config(state=tk.NORMAL)
+        self.chinese_entry.delete(0, tk.END)
+        self.chinese_entry.focus()
+        self.close_selection_dialog()
+
+    def choose_candidate_from_list(self):
+        """確定按鈕或雙擊：選取清單中反白的候選詞，沒有反白時直接關閉"""
+        selection = self.candidate_listbox.curselection()
+        if selection:
+            self.choose_candidate(self.candidate_page_start() + selection[0])
+        else:
+            self.cancel_candidate_window()
+
+    def choose_candidate(self, index):
+        """選取所有候選詞中的第 index 個（先上字模式會取代先上的第一個候選詞）"""
+        matches = self.candidate_window_matches
+        if index < len(matches):
+            selected_word = matches[index]
+            self.record_candidate_usage(selected_word)
+            if self.preselect_mode.get():
+                self.composition.replace_last(matches[0], selected_word)
+            else:
+                self.composition.commit(selected_word)
+        self.cancel_candidate_window()
 
-        dialog.bind("<Key>", handle_new_input)
+    def on_candidate_window_key(self, event):
+        if not self.preselect_mode.get():
+            return
+        
+        char = event.char
+        allowed_chars = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ!@#$%^&*()-_=+`~[]{}|;:,.<>?/\\""'
+        
+        if char and char != ' ' and char in allowed_chars:
+            self.close_selection_dialog()
+            self.chinese_entry.config(state=tk.NORMAL)
+            self.chinese_entry.delete(0, tk.END)
+            self.chinese_entry.insert(0, char)
+            self.chinese_entry.focus()
+            self.clear_candidates()
+            return "break"
 
     def close_selection_dialog(self):
         if self.selection_dialog:
             try:
                 if self.selection_dialog.winfo_exists():
-                    self.selection_dialog.destroy()
+                    self.selection_dialog.grab_release()
+                    self.selection_dialog.withdraw()
             except tk.TclError:
                 pass
             finally:
@@ -908,72 +1131,80 @@ class ClipboardApp:
     def select_candidate_by_number(self, num):
         """根據數字選擇候選詞"""
         # 只有在中文模式且候選視窗開啟且有候選項目時才處理候選選擇
+        # 數字代表候選視窗目前這一頁的第幾個候選詞
+        index = self.candidate_page_start() + num
         if (self.is_chinese_mode.get() and 
             self.is_candidate_window_open() and 
             self.candidates and 
-            0 <= num < len(self.candidates)):
-            self.select_candidate_append(self.candidates[num])
+            0 <= num < self.candidate_page_size and
+            index < len(self.candidates)):
+            self.select_candidate_append(self.candidates[index])
             return
         
         # 如果焦點在中文輸入框且候選視窗未開啟，讓 on_chinese_key_press 處理
         # 其他情況不做任何處理
 
+    @timed("candidate_append")
     def select_candidate_append(self, word):
-        current_text = self.entry.get()
-        self.entry.delete(0, tk.END)
-        self.entry.insert(0, current_text + word)
+        self.record_candidate_usage(word)
+        self.composition.commit(word)
         self.clear_candidates()
         self.candidates = []
 
-    def clear_candidates(self):
-        for widget in self.candidate_frame.winfo_children():
-            widget.destroy()
-        self.candidates = []
+    def load_candidate_usage(self):
+        """載入選字次數統計"""
+        try:
+            self.candidate_usage.load()
+        except Exception as e:
+            messagebox.showerror("錯誤", f"讀取選字統計失敗: {e}")
 
-    def handle_letter_input(self, event):
-        return
+    def rank_candidates(self, code, matches):
+        """依選字次數重新排序候選詞"""
+        if not self.settings["adaptive_candidate_order"]:
+            return matches
+        return self.candidate_usage.rank(code, matches)
 
-    # *** 修改：重寫此函式以實現快取機制 ***
-    def _parse_and_cache_word_tab(self, cache_file):
-        """
-        (輔助函式) 解析 word.tab，將結果存入 self.word_dictionary，並建立二進位快取檔案。
-        這是「慢速路徑」，只在需要時執行。
-        """
-        temp_dict = {}
+    def record_candidate_usage(self, word):
+        """記錄目前字根碼下選了哪個候選詞；累積到一定數量才寫檔"""
+        if not self.current_code:
+            return
+        if self.candidate_usage.record(self.current_code, word):
+            self.save_candidate_usage()
+        self.current_code = ""
+
+    def save_candidate_usage(self):
+        """把尚未寫入的選字次數交給背景執行緒寫檔"""
+        if not self.candidate_usage.pending:
+            return
         try:
-            # 1. 從 word.tab 解析文字
-            with open(self.word_tab_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        code = parts[0]
-                        words = parts[1:]
-                        temp_dict[code] = words
-            
-            self.word_dictionary = temp_dict
+            self.persistence.write(self.usage_file, self.candidate_usage.to_json())
+            self.candidate_usage.mark_flushed()
+        except Exception as e:
+            messagebox.showerror("錯誤", f"儲存選字統計失敗: {e}")
 
-            # 2. 將新建立的字典寫入快取檔案
-            with open(cache_file, "wb") as f_cache:
-                pickle.dump(self.word_dictionary, f_cache)
-                print("詞庫快取已成功建立/更新。")
+    def _flush_usage_periodically(self):
+        """定期把尚未寫入的選字次數寫回檔案"""
+        self.save_candidate_usage()
+        self.root.after(self.usage_flush_interval, self._flush_usage_periodically)
 
-        except Exception as e:
-            messagebox.showerror("錯誤", f"讀取 word.tab 或建立快取失敗: {e}")
-            self.word_dictionary = {} # 確保在失敗時字典是空的
+    def clear_candidates(self):
+        self.preview_label.config(text="")
+        self.candidates = []
 
-    def load_word_tab(self):
+    def handle_letter_input(self, event):
+        return
+
+    # *** 修改：快取改為可 mmap 的二進位索引，以內容雜湊判斷有效性並增量重建 ***
+    def load_word_tab(self, notices):
         """
-        (重構後) 載入 word.tab 檔案。
-        優先使用二進位快取以加速啟動，僅在原始檔更新或快取不存在時才重新解析。
+        (重構後) 載入 word.tab 檔案並回傳詞庫；在背景執行緒執行，不可直接操作 Tk 元件。
+        需要顯示的訊息放入 notices，由 Tk 執行緒在載入完成後顯示。
+        快取以內容雜湊與區塊校驗值判斷是否有效，只有變動的區塊才會重新解析。
         """
-        self.word_dictionary = {}
         cache_file = self.word_tab_file + ".cache" # 快取檔案名稱
+        selectors = self.selector_positions()
 
-        # 情境一：word.tab 檔案不存在，創建範例檔和初始快取
+        # 情境一：word.tab 檔案不存在，創建範例檔（快取在下面一併建立）
         if not os.path.exists(self.word_tab_file):
             sample_data = {
                 "AA": ["寸", "尺", "分"], "BB": ["公分", "公尺"], "CC": ["很好", "不錯", "棒"],
@@ -985,113 +1216,528 @@ class ClipboardApp:
                 with open(self.word_tab_file, "w", encoding="utf-8") as f:
                     for code, words in sample_data.items():
                         f.write(f"{code} {' '.join(words)}\n")
-                
-                # 寫入二進位快取檔
-                with open(cache_file, "wb") as f_cache:
-                    pickle.dump(sample_data, f_cache)
-
-                self.word_dictionary = sample_data
-                messagebox.showinfo("提示", "已創建範例 word.tab 及快取檔案")
+                notices.append(("info", "提示", "已創建範例 word.tab 及快取檔案"))
             except Exception as e:
-                messagebox.showerror("錯誤", f"創建範例 word.tab 失敗: {e}")
-            return # 完成處理，直接返回
+                notices.append(("error", "錯誤", f"創建範例 word.tab 失敗: {e}"))
+                return CompiledWordTable.from_dict(sample_data, selectors)
 
-        # 情境二：word.tab 存在，判斷是否使用快取
-        use_cache = False
-        if os.path.exists(cache_file):
-            try:
-                # 比較 word.tab 和快取檔案的最後修改時間
-                word_tab_mtime = os.path.getmtime(self.word_tab_file)
-                cache_mtime = os.path.getmtime(cache_file)
-                if cache_mtime > word_tab_mtime:
-                    use_cache = True
-            except OSError:
-                use_cache = False # 如果無法獲取時間戳，則不使用快取
-
-        if use_cache:
-            # --- 快速路徑：從快取載入 ---
-            print("偵測到有效快取，正在從快取載入詞庫...")
+        # 情境二：word.tab 存在，沿用、增量更新或重新建立快取
+        try:
+            workers = self.settings["parse_workers"] or None
+            table, message = open_word_table(self.word_tab_file, cache_file, workers, selectors)
+            print(message)
+            return table
+        except Exception as e:
+            notices.append(("error", "錯誤", f"讀取 word.tab 或建立快取失敗: {e}"))
+            return CompiledWordTable.from_dict({})  # 確保在失敗時詞庫是空的
+
+    def load_word_layers(self, system_table, notices):
+        """
+        在系統詞庫上疊加使用者詞庫與覆寫/黑名單層（兩者都是選用的小檔案，不需快取）。
+        自訂詞語只要寫進使用者詞庫，不必動到共用的 word.tab。
+        """
+        try:
+            return apply_word_layers(system_table, self.settings["user_word_tab_file"],
+                                     self.settings["override_word_tab_file"])
+        except Exception as e:
+            notices.append(("error", "錯誤", f"讀取使用者詞庫或覆寫檔失敗: {e}"))
+            return system_table
+
+    def run_in_background(self, work, on_done):
+        """
+        在背景執行緒執行 work()，完成後由 Tk 執行緒以 after 輪詢取回，
+        並呼叫 on_done(結果, 例外)；work 內不可直接操作 Tk 元件。
+        """
+        results = queue.Queue(maxsize=1)
+
+        def worker():
             try:
-                with open(cache_file, "rb") as f:
-                    self.word_dictionary = pickle.load(f)
+                results.put((work(), None))
             except Exception as e:
-                # 如果快取檔案損毀或讀取失敗，則退回到慢速路徑
-                print(f"快取讀取失敗: {e}。將從 word.tab 重新解析。")
-                self._parse_and_cache_word_tab(cache_file)
+                results.put((None, e))
+
+        def poll():
+            try:
+                result, error = results.get_nowait()
+            except queue.Empty:
+                self.root.after(self.background_poll_interval, poll)
+                return
+            on_done(result, error)
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.root.after(self.background_poll_interval, poll)
+
+    def start_word_tab_loading(self):
+        """在背景執行緒載入詞庫，視窗可以立即顯示"""
+        self.word_table_ready = False
+        self.update_mode_label()
+        self._loaded_word_stamps = self._word_source_stamps()
+        self.run_in_background(self._load_word_tab_job, self._on_word_tab_loaded)
+
+    def _load_word_tab_job(self):
+        """
+        (背景執行緒) 載入詞庫，回傳 (詞庫, 提示訊息)；有設定詞庫服務時優先連線到服務。
+        使用者詞庫與覆寫檔是這個使用者自己的檔案，一律在本機疊加在系統詞庫（或服務）之上。
+        """
+        notices = []
+        table = self.connect_word_daemon()
+        if table is None:
+            table = self.load_word_tab(notices)
+        table = self.load_word_layers(table, notices)
+        return table, notices
+
+    def connect_word_daemon(self):
+        """
+        (背景執行緒) 連線到設定中的詞庫服務，回傳 RemoteWordTable；
+        未設定或連不上時回傳 None，由呼叫端改在本機載入。
+        選字尾碼以這裡的設定為準，與服務的設定不同時由 RemoteWordTable 在本機解析候選簡碼。
+        """
+        socket_path = self.settings["dictionary_daemon_socket"]
+        if not socket_path:
+            return None
+        try:
+            table = RemoteWordTable(DaemonClient(socket_path), self._load_local_word_table,
+                                    self.selector_positions())
+        except (OSError, ValueError, DaemonError) as e:
+            print(f"無法連線到詞庫服務 {socket_path}（{e}），改用本機詞庫")
+            return None
+        print(f"已連線到詞庫服務: {socket_path}")
+        return table
+
+    def _load_local_word_table(self):
+        """
+        (背景執行緒) 詞庫服務中途無法使用時，由 RemoteWordTable 呼叫以載入本機的系統詞庫；
+        使用者詞庫與覆寫層已經疊加在 RemoteWordTable 之上，這裡不必再疊一次。
+        """
+        notices = []
+        table = self.load_word_tab(notices)
+        for _, _, message in notices:
+            print(message)
+        return table
+
+    def _on_word_tab_loaded(self, result, error):
+        """(Tk 執行緒) 背景載入完成，換上新詞庫"""
+        if error is not None:
+            table, notices = CompiledWordTable.from_dict({}), [("error", "錯誤", f"載入詞庫失敗: {error}")]
         else:
-            # --- 慢速路徑：從 word.tab 解析並建立快取 ---
-            print("快取無效或不存在，正在從 word.tab 解析詞庫...")
-            self._parse_and_cache_word_tab(cache_file)
+            table, notices = result
+
+        self.close_word_table()
+        self.word_dictionary = table
+        self.word_table_ready = True
+        self.update_mode_label()
+
+        for kind, title, message in notices:
+            if kind == "error":
+                messagebox.showerror(title, message)
+            else:
+                messagebox.showinfo(title, message)
+
+        self.replay_pending_codes()
+
+    def _word_source_stamps(self):
+        """取得各詞庫檔案的 (大小, mtime_ns)，不存在的檔案記為 None；只做 stat，成本很低"""
+        stamps = []
+        for path in (self.word_tab_file, self.settings["user_word_tab_file"], self.settings["override_word_tab_file"]):
+            try:
+                st = os.stat(path)
+                stamps.append((st.st_size, st.st_mtime_ns))
+            except (OSError, TypeError, ValueError):
+                stamps.append(None)
+        return tuple(stamps)
+
+    def _watch_word_tab(self):
+        """
+        定期檢查詞庫檔案是否被更新；檔案變更且連續兩次輪詢都相同（已寫入完成）時，
+        在背景重新載入詞庫，完成後再整份換上，不需要重新開啟程式。
+        """
+        stamps = self._word_source_stamps()
+        if stamps != self._polled_word_stamps:
+            # 檔案可能還在寫入，等下一次輪詢確認穩定
+            self._polled_word_stamps = stamps
+        elif (stamps != self._loaded_word_stamps and stamps[0] is not None
+              and self.word_table_ready and not self._word_tab_reloading):
+            self._loaded_word_stamps = stamps
+            self._word_tab_reloading = True
+            print("偵測到詞庫檔案變更，正在背景重新載入...")
+            self.run_in_background(self._load_word_tab_job, self._on_word_tab_reloaded)
+        self.root.after(self.settings["word_tab_watch_interval"], self._watch_word_tab)
+
+    def _on_word_tab_reloaded(self, result, error):
+        """(Tk 執行緒) 熱更新完成，換上新詞庫"""
+        self._word_tab_reloading = False
+        if error is not None:
+            messagebox.showerror("錯誤", f"重新載入詞庫失敗: {error}")
+            return
+
+        table, notices = result
+        # 查詢都在 Tk 執行緒上同步進行，在這裡換掉參考就不會有查詢看到新舊混雜的詞庫。
+        # 舊詞庫不主動關閉：仍在使用它的背景工作（例如反查）結束後，mmap 會隨參考一起釋放
+        # （Windows 上舊快取檔因此仍被佔用，open_word_table 會把新快取寫到版本化的檔名）
+        old_table, self.word_dictionary = self.word_dictionary, table
+        # 詞庫服務的連線則不會隨參考釋放，每次熱更新都會建立新連線，舊的要明確關閉
+        old_remote = getattr(old_table, "system", old_table)
+        if isinstance(old_remote, RemoteWordTable):
+            old_remote.close()
+        for kind, title, message in notices:
+            if kind == "error":
+                messagebox.showerror(title, message)
+        print("詞庫已更新。")
+
+    def replay_pending_codes(self):
+        """詞庫載入完成後，依序處理載入期間輸入的字根碼（多個候選時取第一個）"""
+        pending = self.pending_codes
+        self.pending_codes = []
+        self.current_code = ""  # 自動取第一個候選，不計入選字次數
+        not_found = []
+        # 一次批次查詢，使用詞庫服務時只需要一次往返
+        results = lookup_codes(self.word_dictionary, pending, self.vr_candidate_mode.get())
+        for code, matches in zip(pending, results):
+            if matches:
+                self.select_candidate_append(matches[0])
+            else:
+                not_found.append(code)
+
+        if not_found:
+            messagebox.showinfo("提示", f"找不到 {', '.join(repr(c) for c in not_found)} 對應的詞語")
+
+    def close_word_table(self):
+        """釋放目前詞庫佔用的 mmap"""
+        table = getattr(self, "word_dictionary", None)
+        if isinstance(table, (CompiledWordTable, LayeredWordTable, RemoteWordTable)):
+            table.close()
+        self.word_dictionary = CompiledWordTable.from_dict({})
 
     def on_enter(self, event):
-        user_input = self.entry.get().strip()
+        user_input = self.composition.get().strip()
         if not user_input:
             return
-        pyperclip.copy(user_input)
+        self.copy_to_clipboard(user_input)
         self.add_to_history(user_input)
-        self.entry.delete(0, tk.END)
+        self.composition.clear()
 
     def on_enter_from_chinese(self, event):
-        user_input = self.entry.get().strip()
+        user_input = self.composition.get().strip()
         if not user_input:
             return
-        pyperclip.copy(user_input)
+        self.copy_to_clipboard(user_input)
         self.add_to_history(user_input)
-        self.entry.delete(0, tk.END)
+        self.composition.clear()
         self.chinese_entry.delete(0, tk.END)
 
     def add_to_history(self, text):
-        if text in self.history:
+        # *** 修改：以集合判斷重複，每次複製只在日誌附加一行，不再重寫整個歷史檔 ***
+        is_new = text not in self.history
+        try:
+            evicted = self.history.add(text)
+        except Exception as e:
+            messagebox.showerror("錯誤", f"儲存歷史紀錄失敗: {e}")
             return
-        self.history.append(text)
-        self.history_listbox.insert(tk.END, text)
-        self.save_history()
+        if evicted is None:  # 已經是最新的一筆
+            return
+        self.update_history_index(text, evicted)
+        if self.history_search_results is not None:
+            self.refresh_history_search()
+            return
+        if not is_new:
+            # 再次複製既有的文字：移到最上面，重新顯示已載入的範圍
+            self.render_history()
+            return
+        if self.history_rows_first > 0:
+            # 已捲到後面的頁面：最新的一筆不在目前的範圍內，清單中每一列的編號都往後移一筆
+            self.history_rows_first += 1
+        else:
+            self.history_listbox.insert(0, text)
+            self.history_rows_loaded += 1
+        # 被淘汰的是最舊的紀錄，若已載入到清單底部就一併移除；也不超過清單的筆數上限
+        extra = max(self.history_rows_first + self.history_rows_loaded - len(self.history),
+                    self.history_rows_loaded - self.history_window_rows)
+        if extra > 0:
+            self.history_listbox.delete(self.history_rows_loaded - extra, tk.END)
+            self.history_rows_loaded -= extra
+
+    def history_rows(self, start, stop):
+        """目前清單要顯示的第 start 到 stop 筆：搜尋中顯示搜尋結果，否則顯示全部歷史"""
+        if self.history_search_results is not None:
+            return self.history_search_results[start:stop]
+        return self.history.recent(start, stop)
+
+    def history_row_count(self):
+        if self.history_search_results is not None:
+            return len(self.history_search_results)
+        return len(self.history)
+
+    def render_history(self):
+        """重新顯示歷史清單：從目前的第一列起保留已載入的筆數（至少一頁），其餘等捲動時再載入"""
+        if self.history_rows_first >= self.history_row_count():
+            self.history_rows_first = 0
+        start = self.history_rows_first
+        rows = self.history_rows(start, start + max(self.history_page_size, self.history_rows_loaded))
+        self.history_listbox.delete(0, tk.END)
+        if rows:
+            self.history_listbox.insert(tk.END, *rows)
+        self.history_rows_loaded = len(rows)
+
+    def reset_history_window(self):
+        """回到清單最上面（例如切換搜尋結果時），下次 render_history 只載入第一頁"""
+        self.history_rows_first = 0
+        self.history_rows_loaded = 0
+
+    def on_history_scrolled(self, first, last):
+        """
+        歷史清單捲到底時載入下一頁、捲到頂端時載入上一頁。
+        清單只保留最多 history_window_rows 筆，一路捲下去也不會把整份歷史都放進 Listbox；
+        從另一端移除的列不在畫面上，再以 yview 維持目前看到的位置。
+        """
+        listbox = self.history_listbox
+        start, loaded = self.history_rows_first, self.history_rows_loaded
+        if float(last) >= 1.0 and start + loaded < self.history_row_count():
+            rows = self.history_rows(start + loaded, start + loaded + self.history_page_size)
+            listbox.insert(tk.END, *rows)
+            loaded += len(rows)
+            trim = max(0, loaded - self.history_window_rows)
+            if trim:
+                top = listbox.nearest(0)
+                listbox.delete(0, trim - 1)
+                listbox.yview(max(0, top - trim))
+                start += trim
+                loaded -= trim
+        elif float(first) <= 0.0 and start > 0:
+            rows = self.history_rows(max(0, start - self.history_page_size), start)
+            listbox.insert(0, *rows)
+            listbox.yview(listbox.nearest(0) + len(rows))
+            start -= len(rows)
+            loaded += len(rows)
+            trim = max(0, loaded - self.history_window_rows)
+            if trim:
+                listbox.delete(loaded - trim, tk.END)
+                loaded -= trim
+        else:
+            return
+        self.history_rows_first, self.history_rows_loaded = start, loaded
 
     def clear_entry(self):
-        self.entry.delete(0, tk.END)
+        self.composition.clear()
         if self.is_chinese_mode.get():
             self.chinese_entry.delete(0, tk.END)
             self.clear_candidates()
         self.close_selection_dialog()
 
     def clear_history(self):
-        self.history = []
-        self.history_listbox.delete(0, tk.END)
-        self.save_history()
+        try:
+            self.history.clear()
+        except Exception as e:
+            messagebox.showerror("錯誤", f"儲存歷史紀錄失敗: {e}")
+        if self.history_index is not None:
+            self.history_index.clear()
+        elif self._history_indexing:
+            self._history_index_pending.append(("clear", None))
+        self.history_search_entry.delete(0, tk.END)
+        self._history_query = ""
+        self.history_search_results = None
+        self.reset_history_window()
+        self.render_history()
         messagebox.showinfo("提示", "歷史紀錄已清除")
 
+    # --- 歷史搜尋 ---
+    def start_history_indexing(self):
+        """
+        在背景執行緒為目前的歷史紀錄建立搜尋索引。
+        不在啟動時建立：多數時候不會用到搜尋，啟動成本因此不隨歷史筆數增加。
+        """
+        if self._history_indexing or self.history_index is not None:
+            return
+        self._history_indexing = True
+        texts = list(self.history)
+        self.run_in_background(lambda: HistorySearchIndex(texts), self._on_history_indexed)
+
+    def _on_history_indexed(self, index, error):
+        self._history_indexing = False
+        if error is not None:
+            print(f"建立歷史搜尋索引失敗: {error}")
+            index = HistorySearchIndex(self.history)
+        else:
+            # 補上建立索引期間的異動
+            for op, text in self._history_index_pending:
+                if op == "add":
+                    index.add(text)
+                elif op == "remove":
+                    index.remove(text)
+                else:
+                    index.clear()
+        self._history_index_pending = []
+        self.history_index = index
+        if self.history_search_results is not None:
+            self.refresh_history_search()
+
+    def update_history_index(self, text, evicted):
+        """新增（或移到最新）一筆紀錄，並移除被淘汰的紀錄"""
+        index = self.history_index
+        if index is None:
+            # 尚未建立索引時不必記錄，建立時會直接讀取當時的歷史紀錄
+            if self._history_indexing:
+                self._history_index_pending.append(("add", text))
+                self._history_index_pending.extend(("remove", old) for old in evicted)
+            return
+        index.add(text)
+        for old in evicted:
+            index.remove(old)
+
+    def on_history_search(self, event=None):
+        """搜尋框內容改變時重新篩選；清空搜尋框時回到完整的歷史清單"""
+        query = self.history_search_entry.get()
+        if query == self._history_query:  # 方向鍵等不會改變內容的按鍵
+            return
+        self._history_query = query
+        if not query:
+            if self.history_search_results is None:
+                return
+            self.history_search_results = None
+            self.reset_history_window()
+            self.render_history()
+            return
+        self.refresh_history_search()
+
+    def refresh_history_search(self):
+        query = self.history_search_entry.get()
+        # 索引還在背景建立時先掃描最近的紀錄，建好後會自動以索引重新搜尋完整的歷史紀錄
+        if self.history_index is None:
+            self.start_history_indexing()
+            self.history_search_results = scan_texts(
+                self.history.recent(0, self.history_scan_limit), query, self.history_search_limit)
+        else:
+            self.history_search_results = self.history_index.search(query, self.history_search_limit)
+        self.reset_history_window()
+        self.render_history()
+
     def on_history_select(self, event):
         selected = self.history_listbox.curselection()
         if selected:
             selected_text = self.history_listbox.get(selected)
-            pyperclip.copy(selected_text)
+            # 用方向鍵或滑鼠快速掃過清單時，只複製最後停下來的那一筆
+            self.copy_to_clipboard(selected_text, debounce=True)
+
+    def copy_to_clipboard(self, text, debounce=False):
+        """寫入剪貼簿；debounce 時延後 clipboard_debounce_ms 毫秒，期間再次複製會取代這一次"""
+        if self._clipboard_copy_job is not None:
+            self.root.after_cancel(self._clipboard_copy_job[0])
+            self._clipboard_copy_job = None
+        delay = self.settings["clipboard_debounce_ms"]
+        if debounce and delay > 0:
+            self._clipboard_copy_job = (self.root.after(delay, self._copy_to_clipboard_now, text), text)
+        else:
+            self._copy_to_clipboard_now(text)
+
+    def _copy_to_clipboard_now(self, text):
+        self._clipboard_copy_job = None
+        with self.latency.measure("clipboard_copy"):
+            self.clipboard.copy(text)
+        self.clipboard_watcher.seen(text)  # 自己複製的內容不必再由監看加入歷史
+
+    def on_external_copy(self, text):
+        """(剪貼簿監看) 其他程式複製了新的文字"""
+        self.add_to_history(text)
+
+    def close_clipboard(self):
+        """結束前補上尚未執行的延後複製，並寫完背景中的複製"""
+        if self._clipboard_copy_job is not None:
+            after_id, text = self._clipboard_copy_job
+            self.root.after_cancel(after_id)
+            self._copy_to_clipboard_now(text)
+        self.clipboard.close()
+        for error in self.clipboard.take_errors():
+            print(f"寫入剪貼簿失敗: {error}")
 
     def load_history(self):
-        if os.path.exists(self.history_file):
-            try:
-                with open(self.history_file, "r", encoding="utf-8") as f:
-                    self.history = json.load(f)
-            except Exception as e:
-                self.history = []
-                messagebox.showerror("錯誤", f"讀取歷史紀錄失敗: {e}")
-        else:
-            self.history = []
+        try:
+            self.history.load()
+        except Exception as e:
+            messagebox.showerror("錯誤", f"讀取歷史紀錄失敗: {e}")
 
     def save_history(self):
+        """歷史紀錄在加入時就已寫進日誌；這裡只等待背景壓縮完成並關閉日誌"""
+        self.history.close()
+        if self.history.compaction_error is not None:
+            print(f"壓縮歷史紀錄失敗，下次啟動時會從日誌復原: {self.history.compaction_error}")
+
+    # --- 效能診斷 ---
+    def open_diagnostics_dialog(self):
+        """顯示各階段輸入延遲的 p50/p95/p99（毫秒），開啟期間每秒更新"""
+        if self.diagnostics_dialog is not None and self.diagnostics_dialog.winfo_exists():
+            self.diagnostics_dialog.lift()
+            return
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("效能診斷")
+        dialog.transient(self.root)
+        self.diagnostics_dialog = dialog
+
+        text = tk.Text(dialog, width=76, height=12, font=("Courier New", 10))
+        text.pack(padx=10, pady=5)
+
+        def refresh():
+            if not dialog.winfo_exists():
+                return
+            text.config(state=tk.NORMAL)
+            text.delete("1.0", tk.END)
+            if self.latency.histograms:
+                text.insert(tk.END, self.latency.format_table())
+            elif self.latency.enabled:
+                text.insert(tk.END, "尚無資料，請先輸入一些文字。")
+            else:
+                text.insert(tk.END, "尚未啟用「記錄輸入延遲」（在設定中開啟）。")
+            text.config(state=tk.DISABLED)
+            dialog.after(1000, refresh)
+
+        def reset():
+            self.latency.reset()
+
+        button_frame = tk.Frame(dialog)
+        button_frame.pack(pady=5)
+        tk.Button(button_frame, text="重設", font=self.button_font, command=reset).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="儲存統計檔", font=self.button_font,
+                  command=self.save_latency_stats).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="關閉", font=self.button_font, command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+
+        refresh()
+
+    def save_latency_stats(self):
+        """把目前的延遲統計交給背景執行緒寫進統計檔"""
+        if not self.latency.histograms:
+            return
         try:
-            with open(self.history_file, "w", encoding="utf-8") as f:
-                json.dump(self.history, f, ensure_ascii=False, indent=2)
+            self.persistence.write(self.settings["latency_stats_file"], self.latency.to_json())
         except Exception as e:
-            messagebox.showerror("錯誤", f"儲存歷史紀錄失敗: {e}")
+            messagebox.showerror("錯誤", f"儲存延遲統計失敗: {e}")
+
+    def _check_persistence_errors(self):
+        """定期把背景寫檔的錯誤顯示出來（背景執行緒不能直接操作 Tk）"""
+        self.report_persistence_errors()
+        self.root.after(self.persistence_check_interval, self._check_persistence_errors)
+
+    def report_persistence_errors(self):
+        for path, error in self.persistence.take_errors():
+            messagebox.showerror("錯誤", f"儲存 {path} 失敗: {error}")
+        for error in self.clipboard.take_errors():
+            messagebox.showerror("錯誤", f"寫入剪貼簿失敗: {error}")
 
     def on_close(self):
         self.save_settings()  # 儲存設定包含視窗位置
         self.save_history()
+        self.save_candidate_usage()
+        self.save_latency_stats()
+        # 依排入順序寫完所有待寫的檔案
+        self.persistence.close()
+        self.report_persistence_errors()
+        self.clipboard_watcher.stop()
+        self.close_clipboard()
         self.close_selection_dialog()
+        self.close_word_table()
         self.root.destroy()
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 平行解析詞庫時，打包成執行檔也能正常啟動子行程
     root = tk.Tk()
     app = ClipboardApp(root)
     root.mainloop()
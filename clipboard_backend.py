@@ -0,0 +1,203 @@
+"""
+讀寫系統剪貼簿。
+
+預設直接使用 Tk 內建的 clipboard_clear/clipboard_append：只是把內容交給 Tk，
+不必像 pyperclip 在 Linux 上每次都啟動一個 xclip/xsel 子行程（每次數十毫秒）。
+指定使用 pyperclip 時改在背景執行緒寫入，接連的複製只寫最後一筆，不會卡住介面。
+pyperclip 是選用套件，沒有安裝時一律使用 Tk。
+
+ClipboardWatcher 定期檢查其他程式複製的內容，閒置時自動拉長檢查間隔。
+"""
+
+import threading
+import tkinter as tk
+
+try:
+    import pyperclip
+except ImportError:
+    pyperclip = None
+
+CLIPBOARD_BACKENDS = ("auto", "tk", "pyperclip")
+
+
+class BackgroundClipboardWriter:
+    """在背景執行緒呼叫 copy_func(text)；尚未寫出的內容會被下一次複製取代"""
+
+    def __init__(self, copy_func):
+        self.copy_func = copy_func
+        self._pending = None
+        self._writing = False
+        self._closed = False
+        self._errors = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def copy(self, text):
+        with self._cond:
+            self._pending = text
+            self._cond.notify_all()
+
+    def _run(self):
+        cond = self._cond
+        while True:
+            with cond:
+                while self._pending is None and not self._closed:
+                    cond.wait()
+                if self._pending is None:
+                    return  # 已關閉且沒有待寫的內容
+                text, self._pending = self._pending, None
+                self._writing = True
+            try:
+                self.copy_func(text)
+            except Exception as e:
+                with cond:
+                    self._errors.append(e)
+            with cond:
+                self._writing = False
+                cond.notify_all()
+
+    def flush(self):
+        """等待最後一次複製寫完"""
+        with self._cond:
+            while (self._pending is not None or self._writing) and self._thread.is_alive():
+                self._cond.wait()
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def take_errors(self):
+        with self._cond:
+            errors, self._errors = self._errors, []
+        return errors
+
+
+class ClipboardBackend:
+    """
+    backend 為 "auto" 或 "tk" 時使用 Tk 的剪貼簿；"pyperclip" 時在背景執行緒呼叫 pyperclip.copy。
+    X11 上 Tk 寫入的內容屬於這個程式，程式結束就會消失，因此 close() 時若裝有 pyperclip，
+    會把最後一次複製的內容交給它（由 xclip/xsel 在程式結束後繼續保存）。
+    """
+
+    def __init__(self, root, backend="auto"):
+        if backend not in CLIPBOARD_BACKENDS:
+            raise ValueError(f"未知的剪貼簿寫入方式: {backend}")
+        self.root = root
+        self.use_tk = backend != "pyperclip" or pyperclip is None
+        self._writer = BackgroundClipboardWriter(pyperclip.copy) if pyperclip is not None else None
+        self._handoff_on_close = self.use_tk and root.tk.call("tk", "windowingsystem") == "x11"
+        self._last_text = None
+
+    def read(self):
+        """讀取剪貼簿中的文字（一律使用 Tk，不啟動子行程）；不是文字或是空的時回傳 None"""
+        try:
+            return self.root.clipboard_get()
+        except tk.TclError:
+            return None
+
+    def owner_timestamp(self):
+        """
+        X11 上取得剪貼簿擁有者取得所有權的時間戳記（只有幾個位元組，不必傳送內容）；
+        其他平台或擁有者不支援時回傳 None。
+        """
+        try:
+            return self.root.clipboard_get(type="TIMESTAMP")
+        except tk.TclError:
+            return None
+
+    def copy(self, text):
+        if self.use_tk:
+            self.root.clipboard_clear()
+            self.root.clipboard_append(text)
+        else:
+            self._writer.copy(text)
+        self._last_text = text
+
+    def take_errors(self):
+        """取出背景寫入時發生的錯誤，由呼叫端決定如何提示"""
+        return self._writer.take_errors() if self._writer is not None else []
+
+    def close(self):
+        """寫完待寫的內容；必須在 root.destroy() 之前呼叫"""
+        if self._writer is None:
+            return
+        if self._handoff_on_close and self._last_text is not None:
+            self._writer.copy(self._last_text)
+        self._writer.close()
+
+
+class ClipboardWatcher:
+    """
+    以 root.after 定期檢查剪貼簿，內容變更時呼叫 on_change(text)。
+
+    - 只保留上一次內容的雜湊值比對，不保存內容本身；
+    - X11 上先比對擁有者的時間戳記，沒有變化就不必讀取內容；
+    - 內容變更後以 min_interval 檢查，之後每次沒有變化就把間隔加倍，最長 max_interval；
+    - 超過 max_chars 個字元的內容（例如整份文件）只記下雜湊值，不交給 on_change。
+    """
+
+    def __init__(self, root, clipboard, on_change, min_interval=250, max_interval=4000, max_chars=100_000):
+        self.root = root
+        self.clipboard = clipboard
+        self.on_change = on_change
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_chars = max_chars
+        self.interval = min_interval
+        self._last_hash = None
+        self._last_timestamp = None
+        self._job = None
+
+    @property
+    def running(self):
+        return self._job is not None
+
+    def start(self):
+        if self._job is not None:
+            return
+        # 啟動時剪貼簿裡原有的內容不算是新複製的
+        self.seen(self.clipboard.read())
+        self._last_timestamp = self.clipboard.owner_timestamp()
+        self.interval = self.min_interval
+        self._job = self.root.after(self.interval, self._poll)
+
+    def stop(self):
+        if self._job is not None:
+            self.root.after_cancel(self._job)
+            self._job = None
+
+    def seen(self, text):
+        """記下這段內容（例如本程式自己複製的文字），之後在剪貼簿看到它時不再通知"""
+        self._last_hash = None if text is None else hash(text)
+
+    def _poll(self):
+        changed = self._check()
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        self._job = self.root.after(self.interval, self._poll)
+
+    def _check(self):
+        """回傳剪貼簿是否有變化"""
+        timestamp = self.clipboard.owner_timestamp()
+        if timestamp is not None:
+            if timestamp == self._last_timestamp:
+                return False
+            self._last_timestamp = timestamp
+        text = self.clipboard.read()
+        if text is None:
+            return False
+        text_hash = hash(text)
+        if text_hash == self._last_hash:
+            return False
+        self._last_hash = text_hash
+        if len(text) > self.max_chars:
+            print(f"剪貼簿內容有 {len(text)} 個字元，超過上限 {self.max_chars}，不加入歷史紀錄")
+        elif text.strip():
+            self.on_change(text)
+        return True
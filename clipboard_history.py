@@ -0,0 +1,183 @@
+"""
+剪貼簿歷史紀錄（不依賴 Tk）。
+
+歷史紀錄由兩個檔案組成：
+- 快照檔（clipboard_history.json）：完整的 JSON 清單，與舊版格式相同；
+- 日誌檔（快照檔名 + ".journal"）：每次複製只附加一行 JSON 紀錄，不必重寫整個檔案。
+日誌累積到一定數量後交給儲存服務在背景壓縮回快照檔。程式中途當掉時，日誌最後一行可能只寫了一半，
+載入時會捨棄這一行並截斷檔案。
+
+紀錄數有上限，以最近使用（LRU）順序淘汰：再次複製既有的文字會把它移到最新的位置，
+超過上限時刪除最久沒有用到的紀錄。
+"""
+
+import json
+import os
+import threading
+
+from persistence import PersistenceService
+
+
+class ClipboardHistory:
+    """
+    保存複製過的文字，由舊到新排列。
+    以保持插入順序的 dict 實作 LRU：判斷重複、移到最新、淘汰最舊的紀錄都是 O(1)。
+    """
+
+    def __init__(self, path, limit=10000, compact_threshold=1000, store=None):
+        self.path = path
+        self.limit = limit  # 最多保留的紀錄數（0 表示不限制）
+        self.journal_path = path + ".journal"
+        self.compacting_path = path + ".journal.compacting"  # 壓縮進行中的舊日誌
+        self.compact_threshold = compact_threshold  # 日誌至少累積多少筆才壓縮
+        self._entries = {}  # {文字: None}，由舊到新
+        self._recent = None  # 由新到舊的清單快取，只在顯示時建立
+        self._journal = None
+        self._journal_records = 0
+        self.store = store if store is not None else PersistenceService()  # 寫出快照用的儲存服務
+        self._compacted = threading.Event()  # 沒有進行中的壓縮時為 set
+        self._compacted.set()
+        self.compaction_error = None  # 最近一次背景壓縮失敗的原因，由呼叫端決定如何提示
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __contains__(self, text):
+        return text in self._entries
+
+    def recent(self, start, stop):
+        """由新到舊取出第 start 到 stop 筆紀錄（供清單只顯示看得到的範圍）"""
+        if self._recent is None:
+            self._recent = list(reversed(self._entries))
+        return self._recent[start:stop]
+
+    # --- 載入與復原 ---
+    def load(self):
+        """讀取快照，再依序重播壓縮中與目前的日誌；快照檔損毀時拋出例外"""
+        self.close()
+        self._entries = {}
+        self._recent = None
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                texts = json.load(f)
+            if self.limit:
+                texts = texts[-self.limit:]  # 上限調低時只保留最新的紀錄
+            self._entries = dict.fromkeys(texts)
+        # 上次壓縮可能在寫完快照、刪除舊日誌前中斷；重播是冪等的，不會產生重複項目
+        if os.path.exists(self.compacting_path):
+            self._replay(self.compacting_path)
+        self._journal_records = self._replay(self.journal_path) if os.path.exists(self.journal_path) else 0
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _replay(self, path):
+        """重播日誌檔，回傳有效紀錄數；最後一行不完整時截斷檔案，捨棄該行"""
+        count = 0
+        valid_size = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 寫到一半就中斷的最後一行
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(record)
+                valid_size += len(line)
+                count += 1
+        if valid_size != os.path.getsize(path):
+            with open(path, "r+b") as f:
+                f.truncate(valid_size)
+        return count
+
+    def _apply(self, record):
+        """套用一筆紀錄，回傳因超過上限而被淘汰的文字"""
+        self._recent = None
+        op = record[0]
+        if op == "add":
+            entries = self._entries
+            entries.pop(record[1], None)  # 既有的文字移到最新的位置
+            entries[record[1]] = None
+            evicted = []
+            while self.limit and len(entries) > self.limit:
+                oldest = next(iter(entries))
+                del entries[oldest]
+                evicted.append(oldest)
+            return evicted
+        if op == "clear":
+            self._entries = {}
+        return []
+
+    # --- 修改 ---
+    def add(self, text):
+        """
+        加入一筆紀錄；已存在的文字會移到最新的位置。
+        回傳被淘汰的舊紀錄清單；text 原本就是最新的一筆時不做任何事並回傳 None。
+        """
+        if self._entries and next(reversed(self._entries)) == text:
+            return None
+        evicted = self._apply(["add", text])
+        self._append(["add", text])
+        return evicted
+
+    def clear(self):
+        self._apply(["clear"])
+        self._append(["clear"])
+
+    def _append(self, record):
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        self._journal_records += 1
+        if self._journal_records >= max(self.compact_threshold, len(self._entries) // 2):
+            self.compact_in_background()
+
+    # --- 壓縮 ---
+    def compact_in_background(self):
+        """
+        把目前的日誌換成新檔，再交給儲存服務在背景把快照寫到暫存檔後改名取代。
+        新紀錄一律寫進新日誌，所以壓縮期間仍可正常加入紀錄。
+        """
+        if not self._compacted.is_set():
+            return
+        if self._journal is not None:
+            self._journal.close()
+        if os.path.exists(self.compacting_path):
+            # 上次壓縮沒有完成：把目前日誌接在舊日誌後面，兩者都要等新快照寫好才能刪除
+            with open(self.journal_path, "rb") as src, open(self.compacting_path, "ab") as dst:
+                dst.write(src.read())
+            os.remove(self.journal_path)
+        elif os.path.exists(self.journal_path):
+            os.replace(self.journal_path, self.compacting_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._journal_records = 0
+
+        snapshot = list(self._entries)
+        self._compacted.clear()
+        self.store.write(self.path,
+                         lambda: json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")),
+                         self._on_snapshot_written)
+
+    def _on_snapshot_written(self, error):
+        """(儲存服務的執行緒) 快照寫好後才能刪除舊日誌"""
+        try:
+            if error is None:
+                os.remove(self.compacting_path)
+            self.compaction_error = error
+        except OSError as e:
+            # 舊日誌仍保留，下次載入時會重播，不會遺失紀錄
+            self.compaction_error = e
+        finally:
+            self._compacted.set()
+
+    def close(self):
+        """等待進行中的壓縮完成並關閉日誌"""
+        if not self._compacted.is_set():
+            self.store.flush()
+            self._compacted.wait()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
@@ -0,0 +1,134 @@
+"""
+組字緩衝區：把選定的詞提交到輸入框。
+
+提交只在輸入框尾端插入新的一段，不再「取出全部內容、清空、再整段寫回」；
+同時記住最後提交那一段的位置，先上字模式改選其他候選詞時只取代那一段，
+不必以 endswith 比對整段文字。
+
+輸入框以轉接器包裝：EntryTarget 用於單行的 tk.Entry，TextTarget 用於多行的 tk.Text
+（以 Tk 的 mark 記錄段落起點，前面的文字被編輯時位置會自動跟著移動，適合長篇文件）。
+"""
+
+import tkinter as tk
+
+
+class EntryTarget:
+    """
+    tk.Entry 的轉接器；段落以 ((起點, 終點), 文字) 表示。
+    位置一律取自 widget.index()：Tk 把 BMP 以外的字元（例如 𠀀、emoji）算成兩個位置，
+    與 Python 的 len() 不同，因此不以文字長度推算位置，也不取出整行內容比對。
+    """
+
+    def __init__(self, entry):
+        self.widget = entry
+
+    def append(self, text):
+        start = self.widget.index(tk.END)
+        self.widget.insert(tk.END, text)
+        return (start, self.widget.index(tk.END)), text
+
+    def is_last(self, segment):
+        """段落是否仍位在輸入框尾端（使用者手動編輯過時，尾端的位置通常會改變）"""
+        return self.widget.index(tk.END) == segment[0][1]
+
+    def replace(self, segment, text):
+        (start, end), old_text = segment
+        self.widget.delete(start, end)
+        self.widget.insert(start, text)
+        return (start, self.widget.index(tk.END)), text
+
+    def forget(self, segment):
+        pass
+
+    def get(self):
+        return self.widget.get()
+
+    def clear(self):
+        self.widget.delete(0, tk.END)
+
+
+class TextTarget:
+    """
+    tk.Text 的轉接器；段落以 (mark 名稱, 文字) 表示。
+    mark 設為向左靠（left gravity），在段落起點插入的文字不會被算進段落。
+    """
+
+    def __init__(self, text_widget):
+        self.widget = text_widget
+        self._mark_serial = 0
+
+    def append(self, text):
+        self._mark_serial += 1
+        mark = f"composition_{self._mark_serial}"
+        self.widget.mark_set(mark, "end-1c")
+        self.widget.mark_gravity(mark, tk.LEFT)
+        self.widget.insert("end-1c", text)
+        return mark, text
+
+    def is_last(self, segment):
+        # 只取出段落本身比對，成本與整份文件的長度無關
+        mark, text = segment
+        try:
+            return self.widget.get(mark, "end-1c") == text
+        except tk.TclError:  # mark 已被清除
+            return False
+
+    def replace(self, segment, text):
+        mark, old_text = segment
+        self.widget.delete(mark, "end-1c")
+        self.widget.insert("end-1c", text)
+        return mark, text
+
+    def forget(self, segment):
+        try:
+            self.widget.mark_unset(segment[0])
+        except tk.TclError:
+            pass
+
+    def get(self):
+        return self.widget.get("1.0", "end-1c")
+
+    def clear(self):
+        self.widget.delete("1.0", tk.END)
+        marks = [m for m in self.widget.mark_names() if m.startswith("composition_")]
+        if marks:
+            self.widget.mark_unset(*marks)
+
+
+def make_composition_target(widget):
+    """依元件類型取得對應的轉接器"""
+    if isinstance(widget, tk.Text):
+        return TextTarget(widget)
+    return EntryTarget(widget)
+
+
+class CompositionBuffer:
+    """
+    記錄最後提交的一段（段落邊界），提供：
+    - commit(text)：在尾端附加一段；
+    - replace_last(expected, text)：最後一段仍是 expected 且在尾端時換成 text，否則改為附加。
+    送出或清除輸入框時呼叫 clear()。
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self._last = None
+
+    def commit(self, text):
+        if self._last is not None:
+            self.target.forget(self._last)
+        self._last = self.target.append(text)
+
+    def replace_last(self, expected, text):
+        """先上字模式：取代先上的候選詞；先上的詞已不在尾端（例如使用者編輯過）時直接附加"""
+        if self._last is not None and self._last[1] == expected and self.target.is_last(self._last):
+            self._last = self.target.replace(self._last, text)
+        else:
+            self.commit(text)
+
+    def get(self):
+        return self.target.get()
+
+    def clear(self):
+        self.target.clear()
+        self._last = None
@@ -0,0 +1,132 @@
+"""
+剪貼簿歷史紀錄的全文搜尋索引（不依賴 Tk）。
+
+以單字與兩字 gram 的倒排索引找出候選紀錄，查詢時只走訪查詢字串中最少見的 gram 所對應的紀錄，
+確認是否真的包含查詢字串，不必逐筆掃描所有歷史紀錄。英文不分大小寫。
+
+gram 依兩個字元的字碼分到固定數量的桶子，每個桶子是一個 array("I") 的紀錄編號清單：
+不同的 gram 落在同一個桶子沒有關係（本來就會再確認一次），記憶體只跟 gram 的出現次數有關
+（每次 4 bytes），不會因為中日韓文字的 gram 種類很多就產生數百萬個小清單。
+單一字元視為與 U+0000 組成的兩字 gram，放在同一組桶子裡，單字查詢也只走訪一個桶子。
+"""
+
+from array import array
+from collections import deque
+from itertools import repeat
+from operator import add
+
+INDEX_CHARS = 300  # 每筆紀錄只索引前面這麼多字，避免貼上長文章時索引暴增
+BUCKET_BITS = 16  # 兩字 gram 分到 2**16 個桶子
+_BUCKET_MASK = (1 << BUCKET_BITS) - 1
+_BUCKET_MULTIPLIER = 40503  # 奇數，同一個首字的 gram 會分散到不同的桶子
+EAGER_REMOVE_LENGTH = 32  # 紀錄清單不超過這個長度時直接移除，較長的清單延後到累積一半失效再一起清理
+
+
+def _bigram_buckets(folded, chars=False):
+    """
+    已轉成小寫（casefold）的文字中，所有兩字 gram 所在的桶子；chars 為真時也加入每個單一字元。
+    以字碼陣列計算，迴圈都在 map 內完成，不必為每個 gram 建立字串。
+    """
+    codes = array("I")
+    codes.frombytes(folded.encode("utf-32-le", "surrogatepass"))
+    scaled = list(map(_BUCKET_MULTIPLIER.__mul__, codes))
+    buckets = set(map(_BUCKET_MASK.__and__, map(add, scaled, codes[1:])))
+    if chars:
+        buckets.update(map(_BUCKET_MASK.__and__, scaled))
+    return buckets
+
+
+def _char_bucket(char):
+    """單一字元所在的桶子（等同該字元與 U+0000 組成的兩字 gram）"""
+    return (_BUCKET_MULTIPLIER * ord(char)) & _BUCKET_MASK
+
+
+def scan_texts(texts, query, limit=200):
+    """不使用索引，依 texts 的順序逐筆確認是否包含 query（不分大小寫），最多 limit 筆"""
+    query = query.casefold()
+    results = []
+    if not query:
+        return results
+    if query.upper() == query:
+        # 沒有大小寫之分的字元（例如中日韓文字）不必先轉換每一筆紀錄
+        matches = (text for text in texts if query in text)
+    else:
+        matches = (text for text in texts if query in text.casefold())
+    for text in matches:
+        results.append(text)
+        if len(results) >= limit:
+            break
+    return results
+
+
+class HistorySearchIndex:
+    """
+    紀錄編號依加入順序遞增，每個清單因此永遠是排序好的；
+    再次加入既有的文字會換一個新編號，所以編號越大代表越近期使用。
+    常見 gram 的清單可能有數萬筆，移除紀錄時不逐一從中刪除（每次都要搬移整個清單），
+    只記下失效的數量，等到超過一半時才重建該清單；查詢時會略過已失效的編號。
+    """
+
+    def __init__(self, texts=()):
+        self.clear()
+        for text in texts:
+            self.add(text)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, text):
+        """加入或更新一筆紀錄（既有的文字會移到最近期）"""
+        self.remove(text)
+        doc_id = self._next_id
+        self._next_id += 1
+        self._ids[text] = doc_id
+        self._texts[doc_id] = text
+        buckets = _bigram_buckets(text[:INDEX_CHARS].casefold(), chars=True)
+        # 等同逐一 self._buckets[bucket].append(doc_id)；建立索引時這是最常執行的迴圈
+        deque(map(array.append, map(self._buckets.__getitem__, buckets), repeat(doc_id)), maxlen=0)
+
+    def remove(self, text):
+        """移除一筆紀錄（例如被淘汰時）；不存在時不做任何事"""
+        doc_id = self._ids.pop(text, None)
+        if doc_id is None:
+            return
+        texts = self._texts
+        del texts[doc_id]
+        stale = self._stale
+        for bucket in _bigram_buckets(text[:INDEX_CHARS].casefold(), chars=True):
+            ids = self._buckets[bucket]
+            if len(ids) <= EAGER_REMOVE_LENGTH:
+                ids.remove(doc_id)
+                continue
+            stale[bucket] += 1
+            if stale[bucket] * 2 > len(ids):
+                self._buckets[bucket] = array("I", (i for i in ids if i in texts))
+                stale[bucket] = 0
+
+    def clear(self):
+        self._buckets = [array("I") for _ in range(_BUCKET_MASK + 1)]
+        self._stale = [0] * (_BUCKET_MASK + 1)  # 各桶子中已失效的編號數
+        self._ids = {}  # {文字: 編號}
+        self._texts = {}  # {編號: 文字}，依編號（由舊到新）排列
+        self._next_id = 0
+
+    def search(self, query, limit=200):
+        """回傳包含 query 的紀錄（不分大小寫），由新到舊最多 limit 筆"""
+        query = query.casefold()
+        if not query:
+            return []
+        if len(query) == 1:
+            shortest = self._buckets[_char_bucket(query)]
+        else:
+            shortest = min((self._buckets[bucket] for bucket in _bigram_buckets(query[:INDEX_CHARS])), key=len)
+        results = []
+        texts = self._texts
+        for doc_id in reversed(shortest):
+            text = texts.get(doc_id)
+            # 略過已移除的紀錄；同一個桶子裡的紀錄也不一定包含整個查詢字串，需要再確認一次
+            if text is not None and query in text.casefold():
+                results.append(text)
+                if len(results) >= limit:
+                    break
+        return results
@@ -0,0 +1,416 @@
+"""
+詞庫常駐服務（Unix domain socket，asyncio）。
+
+同一台機器上的多個輸入法工作階段共用一份已載入的詞庫，不必各自載入。
+通訊協定是一行一個 JSON：請求 {"op": ..., ...}，回應 {"results": [...]} 或 {"error": "..."}；
+查詢一律以批次傳送（codes / prefixes / patterns / words 都是清單），一次往返可以查很多筆。
+
+    python ime_daemon.py --word-tab word.tab                  # 啟動服務
+    python ime_daemon.py --socket /run/cime/dict.sock --mode 666
+
+主程式在設定中指定 dictionary_daemon_socket 後，會以 RemoteWordTable 連線到這個服務；
+服務無法使用時暫時改用本機載入的詞庫，過一段時間再重新連線。
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from ime_engine import apply_word_layers, lookup_code
+from word_table import (
+    DEFAULT_SELECTORS, SELECTOR_MIN_CODE_LENGTH, CompiledWordTable, format_selectors, normalize_selectors,
+    open_word_table, parse_selectors,
+)
+
+REQUEST_LIMIT = 16 * 1024 * 1024  # 單一請求（一行 JSON）的大小上限
+DAEMON_RETRY_INTERVAL = 5.0  # 詞庫服務無法使用後，隔多少秒再嘗試連線
+
+
+def default_socket_path():
+    """每個使用者各自的預設 socket 路徑"""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(runtime_dir, f"cime_wcb-{os.getuid()}.sock")
+
+
+class DaemonError(RuntimeError):
+    """服務回報的錯誤（請求格式不正確等），與連線失敗不同，不會觸發改用本機詞庫"""
+
+
+# --- 服務端 ---
+class DictionaryServer:
+    """持有一份詞庫並回應批次查詢；word.tab 或詞庫層更新時在背景重新載入"""
+
+    def __init__(self, word_tab_file, user_file=None, override_file=None, selectors=None):
+        self.word_tab_file = word_tab_file
+        self.user_file = user_file
+        self.override_file = override_file
+        self.selectors = selectors
+        self.table = None
+        self._stamps = None
+
+    def _source_stamps(self):
+        stamps = []
+        for path in (self.word_tab_file, self.user_file, self.override_file):
+            try:
+                st = os.stat(path) if path else None
+                stamps.append((st.st_size, st.st_mtime_ns) if st else None)
+            except OSError:
+                stamps.append(None)
+        return stamps
+
+    def load(self):
+        """載入（或重新載入）詞庫，回傳說明訊息"""
+        stamps = self._source_stamps()
+        table, message = open_word_table(self.word_tab_file, self.word_tab_file + ".cache",
+                                         selectors=self.selectors)
+        # 反查與萬用字元索引在這裡先建好，第一個 reverse/wildcard 請求不必等待數秒
+        table.load_indexes()
+        self.table = apply_word_layers(table, self.user_file, self.override_file)
+        self._stamps = stamps
+        # 舊詞庫不關閉：可能還有請求正在使用，mmap 由記憶體回收釋放
+        return message
+
+    def handle(self, request):
+        """處理一個請求，回傳可序列化成 JSON 的結果"""
+        table = self.table
+        op = request.get("op")
+        if op == "info":
+            return {"count": len(table), "selectors": table.selectors}
+        if op == "lookup":
+            vr_mode = request.get("vr", True)
+            return [lookup_code(table, code, vr_mode) for code in request["codes"]]
+        if op == "shortcode":
+            return [table.resolve_shortcode(code) for code in request["codes"]]
+        if op == "prefix":
+            limit = request.get("limit", 8)
+            return [list(table.prefix_items(prefix, limit)) for prefix in request["prefixes"]]
+        if op == "wildcard":
+            limit = request.get("limit", 50)
+            scan_budget = request.get("scan_budget", 50000)
+            return [list(table.wildcard_items(pattern, limit, scan_budget)) for pattern in request["patterns"]]
+        if op == "reverse":
+            return [list(table.reverse_entries(word)) for word in request["words"]]
+        raise ValueError(f"不支援的操作: {op}")
+
+    async def handle_client(self, reader, writer):
+        """
+        同一條連線可以連續送出多個請求。查詢在執行緒中處理，
+        一個耗時的請求（例如大量反查）不會卡住事件迴圈，其他用戶端照常得到回應。
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    results = await loop.run_in_executor(None, self.handle, json.loads(line))
+                    response = json.dumps({"results": results}, ensure_ascii=False)
+                except Exception as e:
+                    response = json.dumps({"error": f"{type(e).__name__}: {e}"}, ensure_ascii=False)
+                writer.write(response.encode("utf-8") + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            pass  # 服務結束時取消仍連線中的用戶端
+        finally:
+            writer.close()
+
+    async def watch(self, interval):
+        """定期檢查詞庫檔案，有變動且已穩定時在執行緒中重新載入，載入期間照常回應查詢"""
+        loop = asyncio.get_running_loop()
+        polled = self._stamps
+        while True:
+            await asyncio.sleep(interval)
+            stamps = self._source_stamps()
+            if stamps != self._stamps and stamps == polled and stamps[0] is not None:
+                try:
+                    print(await loop.run_in_executor(None, self.load))
+                except Exception as e:
+                    print(f"重新載入詞庫失敗，沿用目前的詞庫: {e}", file=sys.stderr)
+            polled = stamps
+
+    async def serve(self, path, mode=0o600, watch_interval=2.0):
+        if os.path.exists(path):
+            if _socket_in_use(path):
+                raise OSError(f"{path} 已有服務在執行")
+            os.remove(path)  # 上次異常結束留下的 socket 檔
+        server = await asyncio.start_unix_server(self.handle_client, path, limit=REQUEST_LIMIT)
+        os.chmod(path, mode)
+        print(f"詞庫服務已啟動: {path}")
+        try:
+            async with server:
+                if watch_interval > 0:
+                    asyncio.get_running_loop().create_task(self.watch(watch_interval))
+                await server.serve_forever()
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _socket_in_use(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+            return True
+        except OSError:
+            return False
+
+
+# --- 用戶端 ---
+class DaemonClient:
+    """
+    同步的用戶端，供 Tk 主程式與背景執行緒使用。連線建立後持續沿用；
+    連線中斷時（例如服務重新啟動）自動重連一次，仍失敗才拋出 OSError。
+    """
+
+    def __init__(self, path, timeout=0.5):
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()  # 主程式的 Tk 執行緒與背景執行緒可能同時查詢
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._file = sock.makefile("rwb")
+
+    def request(self, op, **params):
+        payload = json.dumps(dict(params, op=op), ensure_ascii=False).encode("utf-8") + b"\n"
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._file.write(payload)
+                    self._file.flush()
+                    line = self._file.readline()
+                    if not line:
+                        raise ConnectionResetError("詞庫服務已中斷連線")
+                    break
+                except OSError:
+                    self._close_socket()
+                    if attempt == 2:
+                        raise
+        response = json.loads(line)
+        if "error" in response:
+            raise DaemonError(response["error"])
+        return response["results"]
+
+    def _close_socket(self):
+        for closable in (self._file, self._sock):
+            if closable is not None:
+                try:
+                    closable.close()
+                except OSError:
+                    pass
+        self._sock = self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close_socket()
+
+
+class RemoteWordTable:
+    """
+    以詞庫服務為後端、介面與 CompiledWordTable 相同的詞庫。
+    服務無法使用（連線失敗或逾時）時，在背景執行緒以 fallback_loader() 載入本機詞庫，
+    之後 retry_interval 秒內的查詢改查本機詞庫，時間到了再試一次服務。
+    本機詞庫還在載入時查詢不會等待，直接當作查無結果。
+
+    selectors 與服務使用的選字尾碼設定不同時，候選簡碼改在用戶端依 selectors 解析
+    （查詢去掉尾碼後的字根碼，再取對應位置的候選詞），結果與本機載入的詞庫相同。
+    """
+
+    def __init__(self, client, fallback_loader, selectors=None, retry_interval=DAEMON_RETRY_INTERVAL):
+        self.client = client
+        self.retry_interval = retry_interval
+        self._fallback_loader = fallback_loader
+        self._local = None
+        self._local_loading = False
+        self._retry_at = None  # 服務無法使用時，下次再嘗試的時間（time.monotonic）
+        self._closed = False
+        self._lock = threading.Lock()
+        info = client.request("info")  # 連不上時直接拋出 OSError，由呼叫端改用本機詞庫
+        self._count = info["count"]
+        self.selectors = info["selectors"] if selectors is None else normalize_selectors(selectors)
+        self._local_selectors = self.selectors != info["selectors"]
+
+    @property
+    def is_remote(self):
+        return self._retry_at is None
+
+    def _service_unavailable(self, error):
+        with self._lock:
+            if self._retry_at is None:
+                print(f"詞庫服務無法使用（{error}），暫時改用本機詞庫")
+            self._retry_at = time.monotonic() + self.retry_interval
+            if self._local is None and not self._local_loading and not self._closed:
+                self._local_loading = True
+                threading.Thread(target=self._load_local, daemon=True).start()
+
+    def _load_local(self):
+        """(背景執行緒) 載入本機詞庫；失敗時下次服務無法使用時再試"""
+        try:
+            table = self._fallback_loader()
+        except Exception as e:
+            print(f"載入本機詞庫失敗: {e}")
+            table = None
+        with self._lock:
+            self._local_loading = False
+            if self._closed:
+                if table is not None:
+                    table.close()
+                return
+            self._local = table
+
+    def _local_table(self):
+        """本機詞庫；還在載入（或載入失敗）時回傳空的詞庫，不等待"""
+        table = self._local
+        return table if table is not None else _EMPTY_TABLE
+
+    def _call(self, op, **params):
+        """送出單筆批次請求；服務無法使用時回傳 None，由呼叫端改查本機詞庫"""
+        if self._closed:
+            return None
+        retry_at = self._retry_at
+        if retry_at is not None and time.monotonic() < retry_at:
+            return None
+        try:
+            results = self.client.request(op, **params)
+        except OSError as e:
+            self._service_unavailable(e)
+            return None
+        if retry_at is not None:
+            print("詞庫服務已恢復")
+            self._retry_at = None
+        return results
+
+    def lookup_many(self, codes, vr_mode=True):
+        """一次查詢多個字根碼（含 VR 候選簡碼），只需一次往返"""
+        codes = list(codes)
+        results = self._call("lookup", codes=codes, vr=vr_mode and not self._local_selectors)
+        if results is None:
+            table = self._local_table()
+            return [lookup_code(table, code, vr_mode) for code in codes]
+        if vr_mode and self._local_selectors:
+            self._resolve_shortcodes(codes, results)
+        return results
+
+    def _resolve_shortcodes(self, codes, results):
+        """依本機的選字尾碼設定，把沒有完全匹配的候選簡碼換成對應的候選詞（再一次往返）"""
+        pending = [i for i, (code, words) in enumerate(zip(codes, results))
+                   if not words and len(code) > SELECTOR_MIN_CODE_LENGTH and code[-1:].upper() in self.selectors]
+        if not pending:
+            return
+        bases = self._call("lookup", codes=[codes[i][:-1] for i in pending], vr=False)
+        for i, words in zip(pending, bases or ()):
+            position = self.selectors[codes[i][-1:].upper()]
+            if position < len(words):
+                results[i] = [words[position]]
+
+    def get(self, code, default=None):
+        words = self.lookup_many([code], vr_mode=False)[0]
+        return words if words else default
+
+    def __getitem__(self, code):
+        words = self.get(code)
+        if words is None:
+            raise KeyError(code)
+        return words
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+    def __len__(self):
+        if self._retry_at is None or self._local is None:
+            return self._count
+        return len(self._local)
+
+    def resolve_shortcode(self, shortcode):
+        if self._local_selectors:
+            base = shortcode[:-1]
+            position = self.selectors.get(shortcode[-1:].upper())
+            if position is None or len(base) < SELECTOR_MIN_CODE_LENGTH:
+                return None
+            words = self.get(base, [])
+            return words[position] if position < len(words) else None
+        results = self._call("shortcode", codes=[shortcode])
+        if results is None:
+            return self._local_table().resolve_shortcode(shortcode)
+        return results[0]
+
+    def prefix_items(self, prefix, limit=None):
+        results = self._call("prefix", prefixes=[prefix], limit=limit)
+        if results is None:
+            return self._local_table().prefix_items(prefix, limit)
+        return [(code, words) for code, words in results[0]]
+
+    def wildcard_items(self, pattern, limit=50, scan_budget=50000):
+        results = self._call("wildcard", patterns=[pattern], limit=limit, scan_budget=scan_budget)
+        if results is None:
+            return self._local_table().wildcard_items(pattern, limit, scan_budget)
+        return [(code, words) for code, words in results[0]]
+
+    def reverse_entries(self, word):
+        results = self._call("reverse", words=[word])
+        if results is None:
+            return self._local_table().reverse_entries(word)
+        return [(code, position) for code, position in results[0]]
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            local, self._local = self._local, None
+        self.client.close()
+        if local is not None:
+            local.close()
+
+
+_EMPTY_TABLE = CompiledWordTable.from_dict({})  # 本機詞庫載入完成前的查詢結果
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="共用詞庫的常駐服務")
+    parser.add_argument("--word-tab", default="word.tab", help="系統詞庫 word.tab 的路徑")
+    parser.add_argument("--user-word-tab", default="user_word.tab", help="使用者詞庫")
+    parser.add_argument("--override-word-tab", default="word_override.tab", help="覆寫/黑名單檔")
+    parser.add_argument("--selectors", type=parse_selectors, default=format_selectors(DEFAULT_SELECTORS),
+                        help="候選簡碼的選字尾碼，例如 V=2,R=3")
+    parser.add_argument("--socket", default=None, help="Unix domain socket 路徑")
+    parser.add_argument("--mode", default="600", help="socket 檔的權限（八進位），多位使用者共用時設為 666")
+    parser.add_argument("--watch-interval", type=float, default=2.0, help="檢查詞庫更新的間隔秒數（0 表示停用）")
+    args = parser.parse_args(argv)
+
+    if not hasattr(socket, "AF_UNIX"):
+        print("這個平台不支援 Unix domain socket", file=sys.stderr)
+        return 1
+
+    server = DictionaryServer(args.word_tab, args.user_word_tab, args.override_word_tab,
+                              args.selectors)
+    print(server.load())
+    try:
+        asyncio.run(server.serve(args.socket or default_socket_path(), int(args.mode, 8), args.watch_interval))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 平行解析詞庫時，打包成執行檔也能正常啟動子行程
+    sys.exit(main())
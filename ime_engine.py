@@ -0,0 +1,234 @@
+"""
+不依賴介面的輸入法引擎與批次轉換命令列工具。
+
+載入詞庫（含快取與使用者詞庫/覆寫層）、字根碼查詢與 VR 候選簡碼解析都放在這裡，
+主程式與批次工具共用同一套邏輯。命令列工具從標準輸入或檔案串流讀入以空白分隔的字根碼，
+轉換後輸出到標準輸出；一次只處理一小段輸入，記憶體用量不隨輸入大小成長。
+
+用法：
+    python ime_engine.py < codes.txt > text.txt
+    python ime_engine.py log1.txt log2.txt --policy all --missing mark
+    python ime_engine.py --policy ranked --usage-file candidate_usage.json < codes.txt
+"""
+
+import argparse
+import functools
+import multiprocessing
+import os
+import re
+import sys
+
+from candidate_usage import CandidateUsage
+from word_table import (
+    DEFAULT_SELECTORS, SELECTOR_MIN_CODE_LENGTH, LayeredWordTable, format_selectors, open_word_table,
+    parse_override_tab, parse_selectors, parse_word_tab,
+)
+
+# 候選詞的選擇方式：first 取第一個候選詞、ranked 依選字次數排序後取第一個、all 列出所有候選詞
+CANDIDATE_POLICIES = ("first", "ranked", "all")
+# 找不到字根碼時：keep 原樣輸出字根碼、mark 以 [?字根碼] 標示、drop 略過
+MISSING_POLICIES = ("keep", "mark", "drop")
+
+_LAST_WHITESPACE = re.compile(r"\s(?=\S*\Z)")
+
+
+def apply_word_layers(system_table, user_file=None, override_file=None):
+    """
+    在系統詞庫上疊加使用者詞庫與覆寫/黑名單層（兩者都是選用的小檔案，不需快取）。
+    檔案不存在時略過；讀取失敗時拋出例外，由呼叫端決定如何提示。
+    """
+    user_dict = {}
+    replacements, removals = {}, {}
+    if user_file and os.path.exists(user_file):
+        user_dict = parse_word_tab(user_file)
+    if override_file and os.path.exists(override_file):
+        replacements, removals = parse_override_tab(override_file)
+
+    if not (user_dict or replacements or removals):
+        return system_table
+    return LayeredWordTable(system_table, user_dict, replacements, removals)
+
+
+def lookup_code(table, input_code, vr_mode=True):
+    """
+    查詢字根碼的候選詞：完全匹配優先；沒有完全匹配且啟用 VR 模式時，
+    把「三碼以上 + 選字尾碼」當作候選簡碼，以詞庫預先建好的雜湊索引查一次。
+    """
+    exact_matches = table.get(input_code, [])
+    if exact_matches or not vr_mode:
+        return exact_matches
+    if len(input_code) > SELECTOR_MIN_CODE_LENGTH:
+        word = table.resolve_shortcode(input_code)
+        if word is not None:
+            return [word]
+    return []
+
+
+def lookup_codes(table, codes, vr_mode=True):
+    """批次查詢多個字根碼；詞庫服務（RemoteWordTable）一次往返就能查完"""
+    lookup_many = getattr(table, "lookup_many", None)
+    if lookup_many is not None:
+        return lookup_many(codes, vr_mode)
+    return [lookup_code(table, code, vr_mode) for code in codes]
+
+
+def wildcard_candidates(table, pattern, limit):
+    """
+    以萬用字元索引查詢（? 代表任一字根，* 代表任意多個字根），結果依字根碼排序且有數量上限。
+    回傳 (候選詞清單, 顯示用標籤清單)。
+    """
+    matches = []
+    labels = []
+    for code, words in table.wildcard_items(pattern, limit):
+        for word in words:
+            matches.append(word)
+            labels.append(f"{word}  ({code})")
+    return matches, labels
+
+
+class ImeEngine:
+    """
+    將字根碼轉換成文字。轉換結果以 LRU 快取（大小固定），
+    大量重複字根碼的紀錄檔不必每次都查詢詞庫。
+    """
+
+    def __init__(self, table, vr_mode=True, policy="first", missing="keep", usage=None,
+                 separator="", cache_size=65536):
+        if policy not in CANDIDATE_POLICIES:
+            raise ValueError(f"未知的候選詞選擇方式: {policy}")
+        if missing not in MISSING_POLICIES:
+            raise ValueError(f"未知的缺字處理方式: {missing}")
+        self.table = table
+        self.vr_mode = vr_mode
+        self.policy = policy
+        self.missing = missing
+        self.usage = usage
+        self.separator = separator  # 同一行相鄰兩個轉換結果之間的分隔字串
+        self.convert_code = functools.lru_cache(maxsize=cache_size)(self._convert_code)
+
+    @classmethod
+    def load(cls, word_tab_file, user_file=None, override_file=None, workers=None, selectors=None, **options):
+        """載入 word.tab（沿用或更新 word.tab.cache）與使用者詞庫層，回傳 (引擎, 說明訊息)"""
+        table, message = open_word_table(word_tab_file, word_tab_file + ".cache", workers, selectors)
+        return cls(apply_word_layers(table, user_file, override_file), **options), message
+
+    def close(self):
+        self.table.close()
+
+    def lookup(self, code):
+        return lookup_code(self.table, code, self.vr_mode)
+
+    def _convert_code(self, code):
+        matches = self.lookup(code)
+        if not matches:
+            if self.missing == "keep":
+                return code
+            return f"[?{code}]" if self.missing == "mark" else ""
+        if len(matches) == 1:
+            return matches[0]
+        if self.policy == "all":
+            return "[" + "|".join(matches) + "]"
+        if self.policy == "ranked" and self.usage is not None:
+            return self.usage.rank(code, matches)[0]
+        return matches[0]
+
+    def convert_text(self, text):
+        """轉換一段文字：以空白分隔的字根碼換成文字，保留換行"""
+        return self._convert_chunk(text, False)[0]
+
+    def _convert_chunk(self, text, pending_separator):
+        """
+        逐行轉換（切行與切詞都交給字串方法，迴圈只剩查詢快取），
+        回傳 (轉換結果, 下一段的第一個詞之前是否要加分隔字串)。
+        """
+        convert = self.convert_code
+        separator = self.separator
+        lines = [separator.join(filter(None, map(convert, line.split()))) for line in text.split("\n")]
+        if pending_separator and separator and lines[0]:
+            lines[0] = separator + lines[0]
+        pending_separator = bool(lines[-1]) or (pending_separator and len(lines) == 1)
+        return "\n".join(lines), pending_separator
+
+    def convert_stream(self, source, target, chunk_size=1 << 16):
+        """
+        從 source 逐段讀取並轉換後寫入 target。每段結尾可能切在字根碼中間，
+        最後一個換行之後的部分留到下一段再處理，因此任何時候只保留一段輸入在記憶體中；
+        整段都沒有換行時改在最後一個空白處切開。
+        """
+        carry = ""
+        pending_separator = False
+        while True:
+            chunk = source.read(chunk_size)
+            text = carry + chunk
+            if chunk:
+                cut = text.rfind("\n")
+                if cut < 0:
+                    match = _LAST_WHITESPACE.search(text, max(0, len(text) - chunk_size))
+                    cut = match.start() if match else -1
+                if cut < 0:
+                    # 一整段都是同一個字根碼（不是正常的輸入），繼續累積到遇到空白為止
+                    carry = text
+                    continue
+                text, carry = text[:cut + 1], text[cut + 1:]
+            else:
+                carry = ""
+            # 上一段最後一個詞與這一段第一個詞之間仍要加上分隔字串
+            converted, pending_separator = self._convert_chunk(text, pending_separator)
+            if converted:
+                target.write(converted)
+            if not chunk:
+                break
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="將以空白分隔的字根碼批次轉換成文字")
+    parser.add_argument("files", nargs="*", help="輸入檔（未指定時讀取標準輸入）")
+    parser.add_argument("--word-tab", default="word.tab", help="系統詞庫 word.tab 的路徑")
+    parser.add_argument("--user-word-tab", default=None, help="使用者詞庫")
+    parser.add_argument("--override-word-tab", default=None, help="覆寫/黑名單檔")
+    parser.add_argument("--policy", choices=CANDIDATE_POLICIES, default="first", help="有多個候選詞時的選擇方式")
+    parser.add_argument("--missing", choices=MISSING_POLICIES, default="keep", help="找不到字根碼時的處理方式")
+    parser.add_argument("--usage-file", default="candidate_usage.json", help="ranked 使用的選字統計檔")
+    parser.add_argument("--no-vr", action="store_true", help="停用 VR 候選簡碼")
+    parser.add_argument("--selectors", type=parse_selectors, default=format_selectors(DEFAULT_SELECTORS),
+                        help="候選簡碼的選字尾碼，例如 V=2,R=3")
+    parser.add_argument("--separator", default="", help="同一行相鄰詞語之間的分隔字串")
+    args = parser.parse_args(argv)
+
+    usage = None
+    if args.policy == "ranked":
+        usage = CandidateUsage(args.usage_file)
+        usage.load()
+
+    try:
+        engine, message = ImeEngine.load(
+            args.word_tab, args.user_word_tab, args.override_word_tab, selectors=args.selectors,
+            vr_mode=not args.no_vr, policy=args.policy, missing=args.missing, usage=usage,
+            separator=args.separator)
+    except OSError as e:
+        print(f"無法載入詞庫: {e}", file=sys.stderr)
+        return 1
+    print(message, file=sys.stderr)
+
+    # 字根碼檔與輸出一律使用 UTF-8，不受系統預設編碼（例如 cp950）影響
+    sys.stdin.reconfigure(encoding="utf-8")
+    sys.stdout.reconfigure(encoding="utf-8")
+    out = sys.stdout
+    try:
+        if not args.files:
+            engine.convert_stream(sys.stdin, out)
+        for path in args.files:
+            with open(path, "r", encoding="utf-8") as f:
+                engine.convert_stream(f, out)
+        out.flush()
+    except OSError as e:
+        print(f"無法讀取輸入檔: {e}", file=sys.stderr)
+        return 1
+    finally:
+        engine.close()
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 平行解析詞庫時，打包成執行檔也能正常啟動子行程
+    sys.exit(main())
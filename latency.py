@@ -0,0 +1,150 @@
+"""
+輸入延遲統計（不依賴 Tk）。
+
+每個階段（按鍵處理、查詢詞庫、顯示候選視窗、寫入剪貼簿……）各有一個固定大小的直方圖：
+區間以 2 的 1/8 次方等比遞增，從 1 微秒涵蓋到約 1 分鐘，百分位數的誤差約在 9% 以內。
+記錄一次只需要一次二分搜尋與一次加法，停用時幾乎沒有額外負擔。
+"""
+
+import json
+import time
+from bisect import bisect_left
+from functools import wraps
+
+_BUCKET_RATIO = 2 ** (1 / 8)
+_MIN_NS = 1_000
+_MAX_NS = 60_000_000_000
+
+
+def _bucket_bounds():
+    bounds = []
+    bound = _MIN_NS
+    while bound < _MAX_NS:
+        bounds.append(round(bound))
+        bound *= _BUCKET_RATIO
+    bounds.append(_MAX_NS)
+    return bounds
+
+
+BUCKET_BOUNDS = _bucket_bounds()  # 各區間的上限（奈秒），最後再加一個溢位區間
+
+
+class LatencyHistogram:
+    """固定大小的延遲直方圖"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.total = 0
+        self.max_ns = 0
+
+    def record(self, ns):
+        self.counts[bisect_left(BUCKET_BOUNDS, ns)] += 1
+        self.total += 1
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def percentile(self, p):
+        """回傳第 p 百分位數（奈秒，取所在區間的上限）；沒有資料時回傳 None"""
+        if not self.total:
+            return None
+        rank = max(1, round(self.total * p / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if index >= len(BUCKET_BOUNDS):
+                    return self.max_ns
+                return min(BUCKET_BOUNDS[index], self.max_ns)
+        return self.max_ns
+
+
+class LatencyRecorder:
+    """依階段名稱收集延遲；enabled 為 False 時不記錄"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}
+
+    def record(self, stage, ns):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = LatencyHistogram()
+        histogram.record(ns)
+
+    def measure(self, stage):
+        """with recorder.measure("階段"): ... 量測區塊內花費的時間"""
+        return _Measurement(self, stage) if self.enabled else _NOT_MEASURED
+
+    def reset(self):
+        self.histograms = {}
+
+    def summary(self):
+        """{階段: {"count", "p50_ms", "p95_ms", "p99_ms", "max_ms"}}，依階段名稱排序"""
+        result = {}
+        for stage in sorted(self.histograms):
+            histogram = self.histograms[stage]
+            result[stage] = {
+                "count": histogram.total,
+                "p50_ms": histogram.percentile(50) / 1e6,
+                "p95_ms": histogram.percentile(95) / 1e6,
+                "p99_ms": histogram.percentile(99) / 1e6,
+                "max_ms": histogram.max_ns / 1e6,
+            }
+        return result
+
+    def to_json(self):
+        return json.dumps(self.summary(), ensure_ascii=False, indent=2)
+
+    def format_table(self):
+        """以文字表格呈現各階段的延遲（毫秒）"""
+        lines = [f"{'階段':<24}{'次數':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'最大':>10}"]
+        for stage, stats in self.summary().items():
+            lines.append(f"{stage:<24}{stats['count']:>8}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}"
+                         f"{stats['p99_ms']:>10.3f}{stats['max_ms']:>10.3f}")
+        return "\n".join(lines)
+
+
+class _Measurement:
+    __slots__ = ("recorder", "stage", "start")
+
+    def __init__(self, recorder, stage):
+        self.recorder = recorder
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc):
+        self.recorder.record(self.stage, time.perf_counter_ns() - self.start)
+        return False
+
+
+class _NotMeasured:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOT_MEASURED = _NotMeasured()
+
+
+def timed(stage):
+    """
+    方法裝飾器：以 self.latency 記錄方法執行的時間。
+    self.latency 停用時直接呼叫原方法。
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            recorder = self.latency
+            if not recorder.enabled:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                recorder.record(stage, time.perf_counter_ns() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,145 @@
+"""
+延後寫入的檔案儲存服務（不依賴 Tk）。
+
+設定、歷史紀錄快照、選字統計都透過同一個背景執行緒寫檔：
+- 短時間內對同一個檔案的多次寫入只會寫最後一次；
+- 每次都先寫到唯一的暫存檔、fsync 後再改名取代，寫到一半當掉也不會毀掉原本的檔案；
+- flush()/close() 依照排入的先後順序寫完所有待寫的檔案。
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+
+def write_atomic(path, content):
+    """
+    先寫暫存檔再改名取代，確保檔案不會只寫了一半。
+    暫存檔名稱每次都不同（mkstemp），多個行程同時寫同一個檔案（例如共用的詞庫快取）
+    也不會互相截斷對方的暫存檔，最後取代上去的一定是某一次完整的寫入。
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    directory, name = os.path.split(os.path.abspath(path))
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except OSError:
+        mode = 0o644  # mkstemp 建立的檔案只有擁有者可讀，改成一般檔案的權限
+    fd, tmp_path = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _chain_callbacks(first, second):
+    if second is None:
+        return first
+
+    def on_done(error):
+        first(error)
+        second(error)
+    return on_done
+
+
+class PersistenceService:
+    """
+    write(path, content) 只把內容排入佇列，由背景執行緒在 delay 秒後寫出。
+    content 可以是 str/bytes，或在背景執行緒呼叫、回傳 str/bytes 的函式
+    （函式內只能讀取呼叫端已經複製好的資料）。
+    """
+
+    def __init__(self, delay=0.5):
+        self.delay = delay  # 收到第一筆寫入後等待多久才開始寫，期間的重複寫入會合併
+        self._pending = {}  # {路徑: (內容, 完成時的回呼)}，依最後一次排入的順序排列
+        self._writing = False
+        self._flush_requested = False
+        self._closed = False
+        self._errors = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, path, content, on_done=None):
+        """
+        排入一次寫入；同一個檔案尚未寫出的內容會被這次取代。
+        on_done(例外或 None) 會在背景執行緒寫完後呼叫。
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("儲存服務已關閉")
+            previous = self._pending.pop(path, None)
+            if previous is not None and previous[1] is not None:
+                # 被取代的寫入不會執行，也要通知等待它的呼叫端
+                on_done = _chain_callbacks(previous[1], on_done)
+            self._pending[path] = (content, on_done)
+            self._cond.notify_all()
+
+    def _run(self):
+        cond = self._cond
+        while True:
+            with cond:
+                while not self._pending and not self._closed:
+                    cond.wait()
+                if not self._pending:
+                    return  # 已關閉且沒有待寫的檔案
+                # 等待 delay 秒讓接連的寫入合併；要求立即寫出時不等待
+                deadline = time.monotonic() + self.delay
+                while not (self._flush_requested or self._closed):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    cond.wait(remaining)
+                batch = list(self._pending.items())
+                self._pending.clear()
+                self._writing = True
+
+            for path, (content, on_done) in batch:
+                error = None
+                try:
+                    write_atomic(path, content() if callable(content) else content)
+                except Exception as e:
+                    error = e
+                    with cond:
+                        self._errors.append((path, e))
+                if on_done is not None:
+                    on_done(error)
+
+            with cond:
+                self._writing = False
+                if not self._pending:
+                    self._flush_requested = False
+                cond.notify_all()
+
+    def flush(self):
+        """立即依序寫出所有待寫的檔案，並等待寫完"""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while (self._pending or self._writing) and self._thread.is_alive():
+                self._cond.wait()
+            self._flush_requested = False
+
+    def close(self):
+        """寫完所有待寫的檔案並結束背景執行緒"""
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def take_errors(self):
+        """取出背景寫檔時發生的錯誤 [(路徑, 例外)]，由呼叫端決定如何提示"""
+        with self._cond:
+            errors, self._errors = self._errors, []
+        return errors
@@ -0,0 +1,1362 @@
+"""
+詞庫編譯與查詢模組（不依賴 Tk）。
+
+word.tab 會被編譯成二進位索引檔（word.tab.cache），內容為：
+已排序的字根碼、位移表、以 UTF-8 儲存的候選詞資料區，以及反查與萬用字元用的索引。
+啟動時以 mmap 開啟並用二分搜尋查找，只有在查詢某個字根碼時才解碼它的候選詞，
+因此啟動時間與記憶體用量不會隨詞庫大小成長。
+"""
+
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import accumulate, chain, compress, repeat
+from operator import add, and_, itemgetter, methodcaller, not_, sub
+
+from persistence import write_atomic
+
+# 檔案格式：MAGIC(8) + 標頭長度(uint32) + JSON 標頭 + 以 4 位元組對齊的各區段
+MAGIC = b"WCBTAB01"
+FORMAT_VERSION = 6
+_PREFIX = struct.Struct("<8sI")
+_U32 = struct.Struct("<I")
+_STAMP = struct.Struct("<QQ")  # word.tab 的大小與 mtime_ns
+_WORD_SEPARATOR = b"\n"  # 候選詞由 split() 切出，不會包含換行
+
+# 區塊切分：在最小長度之後，遇到 crc32 符合遮罩的「錨點行」就切開（以內容決定邊界），
+# 因此在檔案中間插入或刪除幾行，只會影響附近的區塊，後面的區塊仍能重複使用
+BLOCK_MIN_SIZE = 16 * 1024
+BLOCK_MAX_SIZE = 256 * 1024
+_ANCHOR_MASK = 0x3F
+BLOCK_DIGEST_SIZE = 16
+
+# 需要解析的資料超過此大小才啟用多行程平行解析（行程啟動與資料傳遞有固定成本）
+PARALLEL_MIN_BYTES = 16 * 1024 * 1024
+# 變動的區塊超過來源的這個比例時不做增量重建，改為完整編譯（可平行解析）
+INCREMENTAL_MAX_CHANGED = 0.25
+_MISSING = 0xFFFFFFFF  # 已不存在的區塊或詞條編號
+_REMOVED_SHIFT = 1 << 40  # 增量重建時已移除詞條的候選詞位移差
+
+# 候選簡碼：三碼以上的字根碼加上選字尾碼，直接選取第 N 個候選詞（位置從 0 起算）。
+# 預設即原本的 VR 簡碼：V 代表第二個、R 代表第三個候選詞
+DEFAULT_SELECTORS = {"V": 1, "R": 2}
+SELECTOR_MIN_CODE_LENGTH = 3
+_SELECTOR_POSITION_BITS = 4  # 雜湊槽中候選位置佔用的位元數，最多支援第 16 個候選詞
+
+# 萬用字元查詢：為字根碼前幾個位置的字元建立「位置 → 字根碼編號」倒排索引
+WILDCARD_INDEX_DEPTH = 6
+WILDCARD_CHARS = "?*"
+
+
+def parse_word_tab(path):
+    """解析 word.tab 文字檔，回傳 {字根碼: [候選詞, ...]}（重複的字根碼以後出現者為準）"""
+    dictionary = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            parts = line.split()
+            if len(parts) >= 2:
+                dictionary[parts[0]] = parts[1:]
+    return dictionary
+
+
+def split_blocks(data):
+    """依內容決定的行邊界把 word.tab 的位元組切成區塊，回傳 [(起點, 終點), ...]"""
+    blocks = []
+    view = memoryview(data)
+    size = len(data)
+    start = 0
+    while start < size:
+        end = size
+        limit = start + BLOCK_MAX_SIZE
+        # 從最小長度所在行的下一行開始尋找錨點行
+        line_start = data.find(b"\n", start + BLOCK_MIN_SIZE) + 1 if start + BLOCK_MIN_SIZE < size else 0
+        while line_start:
+            line_end = data.find(b"\n", line_start)
+            if line_end < 0:
+                break
+            if line_end + 1 >= limit or zlib.crc32(view[line_start:line_end]) & _ANCHOR_MASK == 0:
+                end = line_end + 1
+                break
+            line_start = line_end + 1
+        blocks.append((start, end))
+        start = end
+    return blocks
+
+
+def block_digest(data):
+    """計算單一區塊的校驗值"""
+    return hashlib.blake2b(data, digest_size=BLOCK_DIGEST_SIZE).digest()
+
+
+def parse_block(data):
+    """
+    解析一個區塊的原始位元組，依出現順序回傳 [(字根碼, 候選詞清單), ...]。
+    區塊一定在換行處切開，因此逐塊解析的結果與 parse_word_tab 逐行讀取相同。
+    """
+    text = data.decode("utf-8")
+    if "\r" in text:
+        # 與文字模式開檔的通用換行處理一致
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    entries = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+
+        parts = line.split()
+        if len(parts) >= 2:
+            entries.append((parts[0], parts[1:]))
+    return entries
+
+
+def _encode_entry(code, words):
+    return code.encode("utf-8"), _WORD_SEPARATOR.join(w.encode("utf-8") for w in words)
+
+
+def _u32_array(values):
+    """建立固定為小端序的 uint32 陣列"""
+    arr = array("I", values)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr
+
+
+def normalize_selectors(selectors):
+    """
+    整理選字尾碼設定：尾碼一律轉成大寫（輸入時不分大小寫），位置必須在支援範圍內。
+    回傳 {尾碼: 候選位置(從 0 起算)}。
+    """
+    normalized = {}
+    for suffix, position in (selectors or {}).items():
+        position = int(position)
+        if len(suffix) != 1 or not 0 <= position < (1 << _SELECTOR_POSITION_BITS):
+            raise ValueError(f"無效的選字尾碼設定: {suffix}={position}")
+        normalized[suffix.upper()] = position
+    return normalized
+
+
+def parse_selectors(text):
+    """解析命令列的選字尾碼設定 "V=2,R=3"（第幾個候選詞，從 1 起算），回傳 {尾碼: 候選位置(從 0 起算)}"""
+    selectors = {}
+    for item in filter(None, text.split(",")):
+        suffix, _, position = item.partition("=")
+        selectors[suffix.strip()] = int(position) - 1
+    return normalize_selectors(selectors)
+
+
+def format_selectors(selectors):
+    """parse_selectors 的反向轉換，用於命令列參數的預設值"""
+    return ",".join(f"{suffix}={position + 1}" for suffix, position in selectors.items())
+
+
+def compile_word_table(dictionary, metadata=None):
+    """將 {字根碼: [候選詞]} 編譯成二進位索引格式，回傳 bytes"""
+    entries = (_encode_entry(code, words) for code, words in dictionary.items())
+    return _pack_table(_compile_fragment([(0, entries)]), metadata=metadata)
+
+
+def _blob_sections(prefix, items):
+    """把一串位元組編成 (位移表, 資料區) 兩個區段"""
+    items = list(items)
+    offsets = [0]
+    offsets += accumulate(map(len, items))
+    return [(prefix + "_offsets", _u32_array(offsets).tobytes()), (prefix, b"".join(items))]
+
+
+def _compile_fragment(blocks, postings=True):
+    """
+    編譯依序排列的 [(區塊編號, [(字根碼位元組, 候選詞位元組), ...]), ...]（重複的字根碼以後出現者為準），
+    回傳詞庫片段 (字根碼, 候選詞, 區塊編號, 被覆蓋的詞條, 倒排清單)：
+    前三者依字根碼排序，都是位元組或編號的清單；UTF-8 位元組排序與 Python 字串的碼位排序一致。
+    被覆蓋的詞條 [(字根碼, 候選詞, 區塊編號)] 依字根碼排序，同一字根碼依出現順序，
+    保留下來才能在覆蓋它的區塊被修改時正確地增量重建。
+    """
+    raw = {}
+    shadowed = []
+    for block_id, entries in blocks:
+        for code_bytes, word_bytes in entries:
+            old = raw.get(code_bytes)
+            if old is not None:
+                shadowed.append((code_bytes,) + old)
+            raw[code_bytes] = (word_bytes, block_id)
+    codes = sorted(raw)
+    entries = list(map(raw.__getitem__, codes))
+    shadowed.sort(key=itemgetter(0))
+    return (codes, list(map(itemgetter(0), entries)), array("I", map(itemgetter(1), entries)), shadowed,
+            _code_postings(codes) if postings else None)
+
+
+def _pack_table(table, refs=None, digests=(), stamp=(0, 0), metadata=None):
+    """把詞庫片段（見 _compile_fragment）與反查索引組成快取檔；refs 為 None 時由候選詞建立"""
+    codes, words, entry_blocks, shadowed, postings = table
+    if refs is None:
+        refs = _reverse_refs(words)
+    sections = [("source_stamp", _STAMP.pack(*stamp))]
+    sections += _blob_sections("code", codes)
+    sections += _blob_sections("word", words)
+    sections.append(("entry_blocks", _u32_array(entry_blocks).tobytes()))
+    sections.append(("block_digests", b"".join(digests)))
+    sections.append(("reverse_refs", _u32_array(refs).tobytes()))
+    sections += _posting_sections(postings)
+    sections += _blob_sections("shadowed_code", map(itemgetter(0), shadowed))
+    sections += _blob_sections("shadowed_word", map(itemgetter(1), shadowed))
+    sections.append(("shadowed_blocks", _u32_array(map(itemgetter(2), shadowed)).tobytes()))
+    return _pack_sections(len(codes), sections, metadata)
+
+
+def _reverse_refs(words):
+    """
+    建立反查索引：所有候選詞在候選詞資料區中的位移，依 (候選詞, 位移) 排序。
+    以整批的 split / sorted 計算，不為每個候選詞建立 tuple，暫時的記憶體只有候選詞清單與編號。
+    """
+    if not words:
+        return array("I")
+    flat = _WORD_SEPARATOR.join(words).split(_WORD_SEPARATOR)
+    # 串接時每個詞條之間多了一個分隔字元，減去詞條編號即為在資料區中的位移
+    counts = map((1).__add__, map(methodcaller("count", _WORD_SEPARATOR), words))
+    entry_numbers = chain.from_iterable(map(repeat, range(len(words)), counts))
+    offsets = list(map(sub, accumulate(map((1).__add__, map(len, flat)), initial=0), entry_numbers))
+    # 穩定排序：相同的候選詞依位移（也就是字根碼順序）排列
+    order = sorted(range(len(flat)), key=flat.__getitem__)
+    return array("I", map(offsets.__getitem__, order))
+
+
+def _position_key(position, char):
+    return f"{position}{char}".encode("utf-8")
+
+
+def _length_key(length):
+    return f"L{length}".encode("utf-8")
+
+
+def _code_postings(codes):
+    """
+    建立萬用字元用的倒排清單 {鍵: 已排序的字根碼編號}：每種字根碼長度，以及前幾個位置的每個字元。
+    每一類鍵以一次穩定排序把編號依鍵值分組，不必逐一把編號加入各個清單。
+    """
+    texts = list(map(bytes.decode, codes))
+    families = [(_length_key, list(map(len, texts)))]
+    for position in range(WILDCARD_INDEX_DEPTH):
+        families.append((partial(_position_key, position),
+                         list(map(itemgetter(slice(position, position + 1)), texts))))
+    postings = {}
+    for make_key, values in families:
+        order = sorted(range(len(values)), key=values.__getitem__)
+        ordered = list(map(values.__getitem__, order))
+        for value in sorted(set(values)):
+            if value == "":  # 字根碼比這個位置短
+                continue
+            postings[make_key(value)] = array("I", order[bisect_left(ordered, value):bisect_right(ordered, value)])
+    return postings
+
+
+def _posting_sections(postings):
+    """倒排清單的鍵依位元組排序存成資料區，清單串接成一個 uint32 陣列"""
+    keys = sorted(postings)
+    offsets = [0]
+    ids = array("I")
+    for key in keys:
+        ids += postings[key]
+        offsets.append(len(ids))
+    sections = _blob_sections("position_key", keys)
+    sections.append(("posting_offsets", _u32_array(offsets).tobytes()))
+    sections.append(("postings", _u32_array(ids).tobytes()))
+    return sections
+
+
+def is_wildcard_code(code):
+    """字根碼中是否含有萬用字元（? 代表任一字根，* 代表任意多個字根）"""
+    return any(char in code for char in WILDCARD_CHARS)
+
+
+def wildcard_regex(pattern):
+    """把萬用字元字根碼轉成完整比對用的正規表示式"""
+    parts = []
+    for char in pattern:
+        if char == "?":
+            parts.append(".")
+        elif char == "*":
+            parts.append(".*")
+        else:
+            parts.append(re.escape(char))
+    return re.compile("".join(parts), re.DOTALL)
+
+
+def _fixed_positions(pattern):
+    """第一個 * 之前的固定字元位置，回傳 [(位置, 字元)]"""
+    fixed = []
+    for position, char in enumerate(pattern.split("*", 1)[0]):
+        if char != "?":
+            fixed.append((position, char))
+    return fixed
+
+
+_selector_hash = zlib.crc32
+
+
+def _selector_slots(codes, counts, selectors):
+    """
+    把所有候選簡碼（字根碼 + 尾碼）放進開放定址的雜湊表；codes / counts 為依編號排列的字根碼位元組與候選詞數。
+    每個槽是一個 uint32：(字根碼編號 << 4 | 候選位置) + 1，0 表示空槽；
+    表的大小至少是簡碼數的兩倍，查詢時平均只需探測一次。簡碼與雜湊值以 map 整批計算，只有放入槽位是逐筆進行。
+    """
+    long_enough = list(map(SELECTOR_MIN_CODE_LENGTH.__le__, map(len, map(bytes.decode, codes))))
+    hashes = []
+    values = []
+    for suffix, position in selectors.items():
+        indexes = list(compress(range(len(codes)), map(and_, long_enough, map(position.__lt__, counts))))
+        keys = map(add, map(codes.__getitem__, indexes), repeat(suffix.encode("utf-8")))
+        hashes += map(_selector_hash, keys)
+        values += map((position + 1).__add__, map((1 << _SELECTOR_POSITION_BITS).__mul__, indexes))
+
+    size = 8
+    while size < len(values) * 2:
+        size *= 2
+    mask = size - 1
+    slots = [0] * size
+    for slot, value in zip(map(mask.__and__, hashes), values):
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = value
+    return slots
+
+
+def _pack_sections(count, sections, metadata=None):
+    """組合標頭與各區段；區段位移先以標頭長度估算，再反覆修正直到穩定"""
+    header = {
+        "version": FORMAT_VERSION,
+        "count": count,
+        "metadata": metadata or {},
+        "sections": {},
+    }
+    data_start = 0
+    while True:
+        offset = data_start
+        layout = {}
+        for name, data in sections:
+            layout[name] = [offset, len(data)]
+            offset += len(data)
+            offset += -offset % 4
+        header["sections"] = layout
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        needed = _PREFIX.size + len(header_bytes)
+        needed += -needed % 4
+        if needed == data_start:
+            break
+        data_start = needed
+
+    out = bytearray(_PREFIX.pack(MAGIC, len(header_bytes)))
+    out += header_bytes
+    out += b"\0" * (data_start - len(out))
+    for name, data in sections:
+        out += data
+        out += b"\0" * (-len(out) % 4)
+    return bytes(out)
+
+
+def _read_header(buffer):
+    """讀取並檢查快取檔的標頭"""
+    magic, header_len = _PREFIX.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("不是有效的詞庫快取檔")
+    header = json.loads(bytes(buffer[_PREFIX.size:_PREFIX.size + header_len]).decode("utf-8"))
+    if header.get("version") != FORMAT_VERSION:
+        raise ValueError(f"不支援的詞庫快取版本: {header.get('version')}")
+    # 各區段都必須完整落在檔案內，被截斷的快取檔直接視為無效
+    end = max((start + length for start, length in header["sections"].values()), default=0)
+    if end > len(buffer):
+        raise ValueError("詞庫快取檔不完整")
+    return header
+
+
+def _map_file(path):
+    """以唯讀 mmap 開啟檔案"""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def write_compiled_table(dictionary, cache_path, metadata=None):
+    """編譯詞庫並寫入快取檔"""
+    data = compile_word_table(dictionary, metadata)
+    write_atomic(cache_path, data)
+    return data
+
+
+def _encode_block(data):
+    """解析一個區塊，回傳編碼後的 [(字根碼位元組, 候選詞位元組), ...]"""
+    return [_encode_entry(code, words) for code, words in parse_block(data)]
+
+
+def _compile_chunk(chunk):
+    """(子行程) 解析並編譯一組連續的區塊 [(區塊編號, 位元組)]，回傳詞庫片段"""
+    return _compile_fragment((block_id, _encode_block(data)) for block_id, data in chunk)
+
+
+def _compile_in_parallel(source, blocks, workers):
+    """
+    把區塊依序分組交給 ProcessPoolExecutor，各行程完成解析、編碼、排序與倒排清單，回傳片段清單。
+    每組約為總量的 1/(4 × 行程數)，讓較慢的行程不會拖住整體；失敗時回傳 None 改走單一行程。
+    """
+    target = max(BLOCK_MAX_SIZE, len(source) // (workers * 4))
+    chunks = []
+    current = []
+    size = 0
+    for block_id, (start, end) in enumerate(blocks):
+        current.append((block_id, source[start:end]))
+        size += end - start
+        if size >= target:
+            chunks.append(current)
+            current = []
+            size = 0
+    if current:
+        chunks.append(current)
+
+    try:
+        # 載入通常在背景執行緒進行，用 spawn 避免在多執行緒的行程中 fork
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            return list(pool.map(_compile_chunk, chunks))
+    except Exception as e:
+        print(f"平行解析失敗: {e}。改用單一行程解析。")
+        return None
+
+
+def _merge_fragments(fragments):
+    """
+    依區塊順序合併片段，結果與把所有區塊編成單一片段相同：
+    同一字根碼以後面片段的詞條為準，前面片段的勝出者改列為被覆蓋的詞條；
+    各片段的編號以 map 換成合併後的編號，逐筆的迴圈都不在 Python 層執行。
+    """
+    if len(fragments) == 1:
+        return fragments[0]
+    # 各片段的字根碼已排序，合併排序後相同的字根碼相鄰，dict.fromkeys 即可去除重複
+    codes = list(dict.fromkeys(sorted(chain.from_iterable(fragment[0] for fragment in fragments))))
+    numbers = dict(zip(codes, range(len(codes))))
+    words = [None] * len(codes)
+    entry_blocks = array("I", bytes(4 * len(codes)))
+    owners = [0] * len(codes)
+    id_maps = []
+    for owner, (fragment_codes, fragment_words, fragment_blocks, _, _) in enumerate(fragments):
+        ids = list(map(numbers.__getitem__, fragment_codes))
+        id_maps.append(ids)
+        deque(map(words.__setitem__, ids, fragment_words), maxlen=0)
+        deque(map(entry_blocks.__setitem__, ids, fragment_blocks), maxlen=0)
+        deque(map(owners.__setitem__, ids, repeat(owner)), maxlen=0)
+
+    shadowed = []
+    lists = {}
+    for owner, ((fragment_codes, fragment_words, fragment_blocks, fragment_shadowed, postings), ids) in enumerate(
+            zip(fragments, id_maps)):
+        shadowed += fragment_shadowed
+        lost = list(compress(range(len(ids)), map(owner.__ne__, map(owners.__getitem__, ids))))
+        shadowed += zip(map(fragment_codes.__getitem__, lost), map(fragment_words.__getitem__, lost),
+                        map(fragment_blocks.__getitem__, lost))
+        for key, local in postings.items():
+            lists.setdefault(key, []).append(array("I", map(ids.__getitem__, local)))
+    # 穩定排序：同一字根碼的詞條維持片段順序，也就是在 word.tab 中的出現順序
+    shadowed.sort(key=itemgetter(0))
+    postings = {key: parts[0] if len(parts) == 1 else array("I", sorted(set().union(*parts)))
+                for key, parts in lists.items()}
+    return codes, words, entry_blocks, shadowed, postings
+
+
+def _splice_table(previous, source, blocks, digests):
+    """
+    以上一版快取為底增量重建，回傳 (詞庫片段, 反查索引, 重新解析的區塊數)；不適用時回傳 None。
+
+    只有出現在變動區塊中的字根碼需要重新決定勝出者與被覆蓋的詞條；其餘詞條、倒排清單與反查索引
+    直接由上一版的區段整批搬移並調整編號與位移，不必重新解析、編碼、排序或建立索引。
+    沿用的區塊必須維持原本的相對順序，且變動的資料不超過來源的 INCREMENTAL_MAX_CHANGED。
+    """
+    block_numbers = {digest: block_id for block_id, digest in enumerate(digests)}
+    old_digests = previous.block_digests()
+    if len(block_numbers) < len(digests) or len(set(old_digests)) < len(old_digests):
+        return None  # 內容重複的區塊無法一對一對應
+    block_map = [block_numbers.get(digest, _MISSING) for digest in old_digests]
+    kept = [block_id for block_id in block_map if block_id != _MISSING]
+    if not kept or kept != sorted(kept):
+        return None
+    kept = set(kept)
+    fresh = [block_id for block_id in range(len(blocks)) if block_id not in kept]
+    if sum(blocks[b][1] - blocks[b][0] for b in fresh) > len(source) * INCREMENTAL_MAX_CHANGED:
+        return None
+
+    new_codes, new_words, new_blocks, new_shadowed, _ = _compile_fragment(
+        ((b, _encode_block(source[blocks[b][0]:blocks[b][1]])) for b in fresh), postings=False)
+    old_codes = previous.section_items("code")
+    old_words = previous.section_items("word")
+    old_blocks = previous.section_u32("entry_blocks")
+    old_word_offsets = previous.section_u32("word_offsets")
+    shadowed_codes = previous.section_items("shadowed_code")
+    shadowed_words = previous.section_items("shadowed_word")
+    shadowed_blocks = previous.section_u32("shadowed_blocks")
+
+    # 受影響的字根碼：變動區塊中新出現的，以及原本有詞條（含被覆蓋者）在已刪除區塊中的
+    dead = [block_id == _MISSING for block_id in block_map]
+    affected = set(new_codes)
+    affected.update(compress(old_codes, map(dead.__getitem__, old_blocks)))
+    affected.update(compress(shadowed_codes, map(dead.__getitem__, shadowed_blocks)))
+    affected = sorted(affected)
+
+    # 依區塊順序重新排列每個受影響字根碼的所有詞條，最後一筆勝出
+    new_numbers = dict(zip(new_codes, range(len(new_codes))))
+    new_shadowed_codes = list(map(itemgetter(0), new_shadowed))
+    positions = list(map(bisect_left, repeat(old_codes), affected))
+    resolved = []
+    for code, position in zip(affected, positions):
+        lo, hi = bisect_left(shadowed_codes, code), bisect_right(shadowed_codes, code)
+        occurrences = list(zip(map(block_map.__getitem__, shadowed_blocks[lo:hi]), shadowed_words[lo:hi]))
+        found = position < len(old_codes) and old_codes[position] == code
+        if found:
+            occurrences.append((block_map[old_blocks[position]], old_words[position]))
+        lo, hi = bisect_left(new_shadowed_codes, code), bisect_right(new_shadowed_codes, code)
+        occurrences += [(block_id, word_bytes) for _, word_bytes, block_id in new_shadowed[lo:hi]]
+        number = new_numbers.get(code)
+        if number is not None:
+            occurrences.append((new_blocks[number], new_words[number]))
+        occurrences = [item for item in occurrences if item[0] != _MISSING]
+        occurrences.sort(key=itemgetter(0))
+        resolved.append((code, position, found, occurrences))
+    resolved.append((None, len(old_codes), False, None))
+
+    # 受影響的字根碼之間的詞條整段搬移，記下每段候選詞位移的變化
+    codes, words = [], []
+    entry_blocks = array("I")
+    id_map = []  # 上一版的詞條編號 → 新編號
+    runs = []  # (上一版候選詞位移起點, 終點, 位移差)
+    inserted = []
+    shadowed = []
+    word_size = 0
+    start = 0
+    for code, position, found, occurrences in resolved:
+        if position > start:
+            base = len(codes)
+            codes += old_codes[start:position]
+            words += old_words[start:position]
+            entry_blocks.extend(map(block_map.__getitem__, old_blocks[start:position]))
+            id_map.extend(range(base, base + position - start))
+            old_start, old_end = old_word_offsets[start], old_word_offsets[position]
+            runs.append((old_start, old_end, word_size - old_start))
+            word_size += old_end - old_start
+        if code is None:
+            break
+        start = position
+        if found:
+            id_map.append(_MISSING)
+            start += 1
+        if occurrences:
+            block_id, word_bytes = occurrences[-1]
+            inserted.append(len(codes))
+            codes.append(code)
+            words.append(word_bytes)
+            entry_blocks.append(block_id)
+            word_size += len(word_bytes)
+            shadowed += [(code, word_bytes, block_id) for block_id, word_bytes in occurrences[:-1]]
+
+    # 倒排清單：舊編號換成新編號（已移除的詞條剔除），再併入新詞條的編號
+    postings = {}
+    key_offsets = previous.section_u32("posting_offsets")
+    old_postings = previous.section_u32("postings")
+    for i, key in enumerate(previous.section_items("position_key")):
+        ids = array("I", filter(_MISSING.__ne__, map(id_map.__getitem__, old_postings[key_offsets[i]:key_offsets[i + 1]])))
+        if ids:
+            postings[key] = ids
+    for key, local in _code_postings([codes[i] for i in inserted]).items():
+        postings[key] = array("I", sorted(chain(postings.get(key, ()), map(inserted.__getitem__, local))))
+
+    # 反查索引：搬移的詞條依所在的段調整位移，保持原本的順序；新詞條的候選詞再逐一插入。
+    # 已移除的詞條落在段與段之間，加上超出 uint32 的位移後剔除
+    bounds = []
+    shifts = [_REMOVED_SHIFT]
+    for old_start, old_end, shift in runs:
+        if old_start < old_end:
+            bounds += (old_start, old_end)
+            shifts += (shift, _REMOVED_SHIFT)
+    old_refs = previous.section_u32("reverse_refs")
+    shifted = map(add, old_refs, map(shifts.__getitem__, map(bisect_right, repeat(bounds), old_refs)))
+    refs = array("I", filter(_REMOVED_SHIFT.__gt__, shifted))
+
+    word_offsets = list(accumulate(map(len, words), initial=0))
+    additions = []
+    for index in inserted:
+        offset = word_offsets[index]
+        for word in words[index].split(_WORD_SEPARATOR):
+            additions.append((word, offset))
+            offset += len(word) + 1
+    additions.sort()
+
+    def ref_key(offset):
+        index = bisect_right(word_offsets, offset) - 1
+        return words[index][offset - word_offsets[index]:].split(_WORD_SEPARATOR, 1)[0], offset
+
+    merged_refs = array("I")
+    lo = 0
+    for item in additions:
+        copied, hi = lo, len(refs)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ref_key(refs[mid]) < item:
+                lo = mid + 1
+            else:
+                hi = mid
+        merged_refs += refs[copied:lo]
+        merged_refs.append(item[1])
+    merged_refs += refs[lo:]
+
+    # 被覆蓋的詞條：未受影響者沿用（換成新的區塊編號），再加入重新排列的結果
+    keep = list(map(not_, map(set(affected).__contains__, shadowed_codes)))
+    shadowed += zip(compress(shadowed_codes, keep), compress(shadowed_words, keep),
+                    map(block_map.__getitem__, compress(shadowed_blocks, keep)))
+    shadowed.sort(key=itemgetter(0))
+    return (codes, words, entry_blocks, shadowed, postings), merged_refs, len(fresh)
+
+
+def build_compiled_data(source, stamp=(0, 0), previous=None, workers=None):
+    """
+    由 word.tab 的完整位元組建立編譯資料，回傳 (bytes, 統計)。
+    若提供上一版快取且只有少數區塊改變，以它為底只重新編譯變動的部分（見 _splice_table）；
+    否則完整編譯，資料量夠大時以 workers 個行程平行編譯各組區塊（None 表示依 CPU 核心數），
+    主行程只負責合併與反查索引。三種方式的結果逐位元組相同。
+    """
+    blocks = split_blocks(source)
+    digests = [block_digest(memoryview(source)[start:end]) for start, end in blocks]
+
+    spliced = None if previous is None else _splice_table(previous, source, blocks, digests)
+    if spliced is not None:
+        table, refs, parsed_blocks = spliced
+    else:
+        if workers is None:
+            workers = os.cpu_count() or 1
+        fragments = None
+        if workers > 1 and len(source) >= PARALLEL_MIN_BYTES:
+            fragments = _compile_in_parallel(source, blocks, workers)
+        if fragments is not None:
+            table = _merge_fragments(fragments)
+        else:
+            table = _compile_fragment((block_id, _encode_block(source[start:end]))
+                                      for block_id, (start, end) in enumerate(blocks))
+        refs = None
+        parsed_blocks = len(blocks)
+
+    metadata = {
+        "source_sha256": hashlib.sha256(source).hexdigest(),
+        "shadowed": len(table[3]),
+    }
+    stats = {"blocks": len(blocks), "parsed_blocks": parsed_blocks}
+    return _pack_table(table, refs, digests, stamp, metadata), stats
+
+
+def _versioned_cache_path(cache_path, digest):
+    """cache_path 被其他工作階段 mmap 住而無法取代時（Windows），改寫到以內容雜湊命名的檔案"""
+    return f"{cache_path}.{digest[:16]}"
+
+
+def _remove_versioned_caches(cache_path):
+    """
+    清除舊的版本化快取檔（及其 .sel 檔）與舊版格式留下的 .rev 檔；
+    仍被其他工作階段使用而刪不掉的留到下次。
+    """
+    directory, name = os.path.split(os.path.abspath(cache_path))
+    pattern = re.compile(re.escape(name) + r"(\.[0-9a-f]{16}(\.rev|\.sel-[0-9a-f]{8})?|\.rev)")
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for entry in names:
+        if pattern.fullmatch(entry):
+            try:
+                os.remove(os.path.join(directory, entry))
+            except OSError:
+                pass
+
+
+def _open_versioned_cache(cache_path, digest, selectors):
+    """
+    開啟先前因為無法取代 cache_path 而寫出的版本化快取；
+    若現在已沒有人使用 cache_path，就把它改名回 cache_path。不存在或不符時回傳 None。
+    """
+    versioned_path = _versioned_cache_path(cache_path, digest)
+    if not os.path.exists(versioned_path):
+        return None
+    try:
+        table = CompiledWordTable.open(versioned_path)
+    except Exception:
+        return None
+    matches = table.metadata.get("source_sha256") == digest
+    table.close()
+    if not matches:
+        return None
+    try:
+        os.replace(versioned_path, cache_path)
+        return CompiledWordTable.open(cache_path, selectors)
+    except OSError:
+        return CompiledWordTable.open(versioned_path, selectors)
+
+
+def open_word_table(word_tab_path, cache_path, workers=None, selectors=None):
+    """
+    開啟 word.tab 對應的編譯快取，必要時重建，回傳 (詞庫, 說明訊息)。
+
+    快取有效性以內容雜湊判斷：大小與 mtime 都與記錄相同時直接沿用；
+    否則計算 word.tab 的 SHA-256，內容相同（例如只被 touch 過）就只更新記錄的時間戳，
+    內容不同時只重新解析校驗值改變的區塊，再寫出新的快取檔。
+
+    選字尾碼的索引不在共用的快取檔中，而是依選字尾碼設定各自存成 .sel 檔：
+    主程式、命令列工具與詞庫服務使用不同的設定時，不會輪流改寫同一個快取檔。
+    回傳前先載入（或建立）這個索引，第一次輸入候選簡碼時不必等待。
+
+    Windows 上仍被 mmap 住的檔案不能被取代（熱更新時舊詞庫還在使用，其他工作階段也可能開著），
+    這時新的快取改寫到以內容雜湊命名的檔案並直接開啟，仍然是 mmap 而不是記憶體中的副本。
+    """
+    selectors = normalize_selectors(DEFAULT_SELECTORS if selectors is None else selectors)
+    table, message = _open_cache(word_tab_path, cache_path, workers, selectors)
+    table.selector_slots()
+    return table, message
+
+
+def _open_cache(word_tab_path, cache_path, workers, selectors):
+    previous = None
+    if os.path.exists(cache_path):
+        try:
+            previous = CompiledWordTable.open(cache_path, selectors)
+        except Exception as e:
+            # 快取損毀或是舊版格式時，從 word.tab 重新建立
+            print(f"快取讀取失敗: {e}。將從 word.tab 重新解析。")
+
+    st = os.stat(word_tab_path)
+    stamp = (st.st_size, st.st_mtime_ns)
+    if previous is not None and previous.source_stamp() == stamp:
+        return previous, "偵測到有效快取，已從快取載入詞庫。"
+
+    with open(word_tab_path, "rb") as f:
+        source = f.read()
+
+    digest = hashlib.sha256(source).hexdigest()
+    if previous is not None and previous.metadata.get("source_sha256") == digest:
+        previous.update_source_stamp(cache_path, stamp)
+        return previous, "word.tab 內容未變更，沿用既有快取。"
+
+    versioned = None
+    if os.path.exists(_versioned_cache_path(cache_path, digest)):
+        # 上次因為 cache_path 被佔用而寫到版本化檔案；先放開自己對 cache_path 的 mmap 才能改名回去
+        if previous is not None:
+            previous.close()
+            previous = None
+        versioned = _open_versioned_cache(cache_path, digest, selectors)
+    if versioned is not None:
+        versioned.update_source_stamp(versioned.path, stamp)
+        return versioned, "word.tab 內容未變更，沿用既有快取。"
+
+    data, stats = build_compiled_data(source, stamp, previous, workers)
+    del source
+    if previous is not None:
+        previous.close()
+    if stats["parsed_blocks"] < stats["blocks"]:
+        message = f"已增量更新詞庫快取（重新解析 {stats['parsed_blocks']}/{stats['blocks']} 個區塊）。"
+    else:
+        message = "詞庫快取已成功建立/更新。"
+
+    try:
+        write_atomic(cache_path, data)
+    except PermissionError:
+        # Windows：cache_path 仍被 mmap 住（例如熱更新前的詞庫），改寫到版本化檔案
+        try:
+            versioned_path = _versioned_cache_path(cache_path, digest)
+            write_atomic(versioned_path, data)
+            return CompiledWordTable.open(versioned_path, selectors), message
+        except OSError as e:
+            return CompiledWordTable(data, selectors=selectors), f"建立詞庫快取失敗: {e}。本次改用記憶體中的詞庫。"
+    except OSError as e:
+        # 快取無法寫入（例如唯讀目錄）時，仍在記憶體中編譯以便正常查詢
+        return CompiledWordTable(data, selectors=selectors), f"建立詞庫快取失敗: {e}。本次改用記憶體中的詞庫。"
+    _remove_versioned_caches(cache_path)
+    return CompiledWordTable.open(cache_path, selectors), message
+
+
+class CompiledWordTable(Mapping):
+    """
+    以 mmap（或記憶體中的 bytes）為底的唯讀詞庫。
+    行為與 dict 相同（get / in / len / 迭代），但候選詞只有在被查詢時才解碼。
+    """
+
+    def __init__(self, buffer, mapped=None, path=None, selectors=None):
+        self._buf = buffer
+        self._mmap = mapped
+        self._views = []
+        self.path = path
+
+        header = _read_header(buffer)
+        self.header = header
+        self.metadata = header.get("metadata", {})
+        self._count = header["count"]
+        sections = header["sections"]
+        self._code_offsets = self._u32_view(*sections["code_offsets"])
+        self._word_offsets = self._u32_view(*sections["word_offsets"])
+        self._codes_start = sections["code"][0]
+        self._words_start = sections["word"][0]
+        self._sections = sections
+        self._posting_index = None
+        self._reverse_refs = None
+        self._selector_slots = None
+        self._side_mmaps = []  # .sel 檔的 mmap
+        self._side_lock = threading.Lock()
+        self.selectors = normalize_selectors(DEFAULT_SELECTORS if selectors is None else selectors)
+
+    @classmethod
+    def open(cls, path, selectors=None):
+        """以唯讀 mmap 開啟編譯好的快取檔"""
+        mapped = _map_file(path)
+        try:
+            return cls(mapped, mapped, path, selectors)
+        except Exception:
+            mapped.close()
+            raise
+
+    @classmethod
+    def from_dict(cls, dictionary, selectors=None):
+        """直接在記憶體中編譯（快取檔無法寫入時的後備方案）"""
+        return cls(compile_word_table(dictionary), selectors=selectors)
+
+    def _u32_view(self, offset, length, buffer=None):
+        if buffer is None:
+            buffer = self._buf
+        if sys.byteorder == "little":
+            view = memoryview(buffer)[offset:offset + length].cast("I")
+            self._views.append(view)
+            return view
+        arr = array("I", bytes(buffer[offset:offset + length]))
+        arr.byteswap()
+        return arr
+
+    def close(self):
+        """釋放 mmap；關閉後不可再查詢"""
+        for view in self._views:
+            view.release()
+        self._views = []
+        for mapped in self._side_mmaps:
+            mapped.close()
+        self._side_mmaps = []
+        self._reverse_refs = None
+        self._selector_slots = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    # --- 來源檔案記錄（增量重建用） ---
+    def source_stamp(self):
+        """回傳建立快取時 word.tab 的 (大小, mtime_ns)"""
+        return _STAMP.unpack_from(self._buf, self._sections["source_stamp"][0])
+
+    def update_source_stamp(self, cache_path, stamp):
+        """內容雜湊相符時，就地改寫快取檔中的時間戳記錄（失敗時只是下次再比對一次雜湊）"""
+        try:
+            with open(cache_path, "r+b") as f:
+                f.seek(self._sections["source_stamp"][0])
+                f.write(_STAMP.pack(*stamp))
+        except OSError:
+            pass
+
+    def block_digests(self):
+        """回傳每個來源區塊的校驗值清單"""
+        offset, length = self._sections["block_digests"]
+        data = bytes(self._buf[offset:offset + length])
+        return [data[i:i + BLOCK_DIGEST_SIZE] for i in range(0, length, BLOCK_DIGEST_SIZE)]
+
+    def section_u32(self, name):
+        """取得 uint32 陣列區段（增量重建用）"""
+        return self._u32_view(*self._sections[name])
+
+    def section_items(self, name):
+        """把 (name_offsets, name) 兩個區段還原成位元組清單（增量重建用）"""
+        start, length = self._sections[name]
+        blob = bytes(self._buf[start:start + length])
+        offsets = self.section_u32(name + "_offsets")
+        return list(map(blob.__getitem__, map(slice, offsets[:-1], offsets[1:])))
+
+    # --- 低階存取 ---
+    def _code_bytes(self, index):
+        base = self._codes_start
+        return self._buf[base + self._code_offsets[index]:base + self._code_offsets[index + 1]]
+
+    def code_at(self, index):
+        """取得第 index 個（依排序）字根碼"""
+        return self._code_bytes(index).decode("utf-8")
+
+    def words_at(self, index):
+        """解碼第 index 個字根碼的候選詞清單"""
+        base = self._words_start
+        raw = self._buf[base + self._word_offsets[index]:base + self._word_offsets[index + 1]]
+        return raw.decode("utf-8").split("\n")
+
+    def find_index(self, code):
+        """二分搜尋字根碼，找不到時回傳 -1"""
+        key = code.encode("utf-8")
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key = self._code_bytes(mid)
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def lower_bound(self, code):
+        """回傳第一個不小於 code 的字根碼索引（已排序索引上的二分搜尋）"""
+        key = code.encode("utf-8")
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._code_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def prefix_items(self, prefix, limit=None):
+        """
+        依字根碼排序，逐一產生以 prefix 開頭的 (字根碼, 候選詞清單)。
+        以二分搜尋定位起點後做區間掃描，成本只與回傳筆數有關，與詞庫大小無關。
+        """
+        key = prefix.encode("utf-8")
+        index = self.lower_bound(prefix)
+        produced = 0
+        while index < self._count and (limit is None or produced < limit):
+            code = self._code_bytes(index)
+            if not code.startswith(key):
+                break
+            yield code.decode("utf-8"), self.words_at(index)
+            produced += 1
+            index += 1
+
+    def _load_posting_index(self):
+        """建立倒排清單的鍵索引；最後才設定 _posting_index，其他執行緒不會看到一半的狀態"""
+        sections = self._sections
+        key_offsets = self._u32_view(*sections["position_key_offsets"])
+        base = sections["position_key"][0]
+        index = {
+            bytes(self._buf[base + key_offsets[i]:base + key_offsets[i + 1]]): i
+            for i in range(len(key_offsets) - 1)
+        }
+        self._posting_offsets = self._u32_view(*sections["posting_offsets"])
+        self._postings = self._u32_view(*sections["postings"])
+        self._posting_index = index
+
+    def load_indexes(self):
+        """預先載入萬用字元與候選簡碼索引（例如詞庫服務載入時），第一個查詢就不必等待建立"""
+        if self._posting_index is None:
+            self._load_posting_index()
+        self.selector_slots()
+
+    def _posting_list(self, key):
+        """取得倒排清單（已排序的字根碼編號）"""
+        if self._posting_index is None:
+            self._load_posting_index()
+        slot = self._posting_index.get(key)
+        if slot is None:
+            return ()
+        return self._postings[self._posting_offsets[slot]:self._posting_offsets[slot + 1]]
+
+    def wildcard_items(self, pattern, limit=50, scan_budget=50000):
+        """
+        依字根碼排序，產生符合萬用字元 pattern 的 (字根碼, 候選詞清單)，最多 limit 筆。
+
+        候選範圍取「固定字首的排序區間」與「各固定位置、字根碼長度的倒排清單」的交集，
+        只逐一驗證這個範圍；最多檢查 scan_budget 個字根碼，避免過於寬鬆的查詢卡住介面。
+        第一個 * 之前至少要有一個固定字元，否則無法使用索引，不回傳任何結果。
+        """
+        fixed = _fixed_positions(pattern)
+        if not fixed:
+            return
+
+        # 固定字首對應一段連續的編號區間
+        literal_prefix = re.split(r"[?*]", pattern, maxsplit=1)[0]
+        lo, hi = 0, self._count
+        if literal_prefix:
+            lo = self.lower_bound(literal_prefix)
+            hi = self.lower_bound(literal_prefix + "\U0010ffff")
+
+        keys = [_position_key(position, char) for position, char in fixed
+                if len(literal_prefix) <= position < WILDCARD_INDEX_DEPTH]
+        if "*" not in pattern:
+            keys.append(_length_key(len(pattern)))
+        lists = []
+        for key in keys:
+            postings = self._posting_list(key)
+            lists.append(postings[bisect_left(postings, lo):bisect_left(postings, hi)])
+        lists.sort(key=len)
+
+        # 從最短的清單開始取交集；其餘清單比目前結果長很多時，直接逐筆驗證反而較快
+        candidates = range(lo, hi)
+        if lists and len(lists[0]) < len(candidates):
+            candidates = lists[0]
+            for other in lists[1:]:
+                if len(other) > 8 * len(candidates):
+                    break
+                candidates = sorted(set(candidates).intersection(other))
+
+        matcher = wildcard_regex(pattern)
+        produced = 0
+        for scanned, index in enumerate(candidates):
+            if produced >= limit or scanned >= scan_budget:
+                break
+            code = self.code_at(index)
+            if matcher.fullmatch(code):
+                yield code, self.words_at(index)
+                produced += 1
+
+    # --- 候選簡碼 ---
+    def resolve_shortcode(self, shortcode):
+        """
+        以預先計算的雜湊索引解析候選簡碼（字根碼 + 選字尾碼，尾碼不分大小寫），
+        回傳對應的候選詞；不是有效的簡碼時回傳 None。
+        """
+        key = shortcode[:-1] + shortcode[-1:].upper()
+        position = self.selectors.get(key[-1:])
+        if position is None:
+            return None
+        slots = self.selector_slots()
+        mask = len(slots) - 1
+        slot = _selector_hash(key.encode("utf-8")) & mask
+        while slots[slot]:
+            value = slots[slot] - 1
+            index = value >> _SELECTOR_POSITION_BITS
+            if (value & ((1 << _SELECTOR_POSITION_BITS) - 1)) == position and self.code_at(index) == key[:-1]:
+                return self.words_at(index)[position]
+            slot = (slot + 1) & mask
+        return None
+
+    def selector_slots(self):
+        """
+        取得候選簡碼的雜湊表。表的內容取決於選字尾碼設定，因此不放在共用的快取檔中，
+        而是依設定存成快取檔旁的 .sel-<設定雜湊> 檔，之後直接 mmap 開啟。
+        """
+        with self._side_lock:
+            if self._selector_slots is None:
+                key = json.dumps(sorted(self.selectors.items()), ensure_ascii=False)
+                suffix = f".sel-{zlib.crc32(key.encode('utf-8')):08x}"
+                self._selector_slots = self._load_side_section(
+                    suffix, key, lambda: _selector_slots(self.section_items("code"), self._word_counts(), self.selectors))
+            return self._selector_slots
+
+    def _word_counts(self):
+        """依編號排列的候選詞數"""
+        start, length = self._sections["word"]
+        blob = bytes(self._buf[start:start + length])
+        offsets = self._word_offsets
+        return list(map((1).__add__, map(blob.count, repeat(_WORD_SEPARATOR), offsets[:-1], offsets[1:])))
+
+    # --- 反查索引（候選詞 → 字根碼） ---
+    def reverse_refs(self):
+        """
+        取得反查索引：所有候選詞在候選詞資料區中的位移，依 (候選詞, 位移) 排序。
+        在編譯時建立並存在快取檔中，每個候選詞只多佔 4 位元組，開啟時不必在記憶體中重建。
+        """
+        if self._reverse_refs is None:
+            self._reverse_refs = self.section_u32("reverse_refs")
+        return self._reverse_refs
+
+    def _side_cache_id(self, key):
+        """用來判斷 .sel 檔是否對應目前快取內容及設定的識別字串"""
+        digest = self.metadata.get("source_sha256")
+        if not digest:
+            return None
+        return f"{digest}:{self._count}:{self._sections['word'][1]}:{key}"
+
+    def _load_side_section(self, suffix, key, build):
+        """
+        開啟快取檔旁的附屬索引檔（path + suffix），內容不符時以 build() 建立並寫出，
+        回傳 uint32 陣列。記憶體中編譯的詞庫（沒有快取檔）只在記憶體中建立。
+        """
+        cache_id = self._side_cache_id(key)
+        side_path = self.path + suffix if self.path and cache_id else None
+        if side_path and os.path.exists(side_path):
+            mapped = None
+            try:
+                mapped = _map_file(side_path)
+                header = _read_header(mapped)
+                if header["metadata"].get("cache_id") == cache_id:
+                    self._side_mmaps.append(mapped)
+                    return self._u32_view(*header["sections"]["data"], buffer=mapped)
+                mapped.close()
+            except Exception:
+                if mapped is not None:
+                    mapped.close()
+
+        values = build()
+        if side_path:
+            data = _pack_sections(len(values), [("data", _u32_array(values).tobytes())], {"cache_id": cache_id})
+            try:
+                write_atomic(side_path, data)
+            except OSError:
+                pass  # 無法寫入時只在記憶體中使用
+        return array("I", values)
+
+    def _word_at_offset(self, offset):
+        """由候選詞位移找出 (所屬字根碼編號, 候選詞位元組)"""
+        index = bisect_right(self._word_offsets, offset) - 1
+        base = self._words_start
+        end = base + self._word_offsets[index + 1]
+        separator = self._buf.find(_WORD_SEPARATOR, base + offset, end)
+        if separator >= 0:
+            end = separator
+        return index, self._buf[base + offset:end]
+
+    def reverse_entries(self, word):
+        """反查 word，回傳 [(字根碼, 候選序號)]，依字根碼排序"""
+        refs = self.reverse_refs()
+        key = word.encode("utf-8")
+        lo, hi = 0, len(refs)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._word_at_offset(refs[mid])[1] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        entries = []
+        base = self._words_start
+        while lo < len(refs):
+            offset = refs[lo]
+            index, found = self._word_at_offset(offset)
+            if found != key:
+                break
+            position = self._buf[base + self._word_offsets[index]:base + offset].count(_WORD_SEPARATOR)
+            entries.append((self.code_at(index), position))
+            lo += 1
+        return entries
+
+    # --- Mapping 介面 ---
+    def get(self, code, default=None):
+        index = self.find_index(code)
+        if index < 0:
+            return default
+        return self.words_at(index)
+
+    def __getitem__(self, code):
+        index = self.find_index(code)
+        if index < 0:
+            raise KeyError(code)
+        return self.words_at(index)
+
+    def __contains__(self, code):
+        return isinstance(code, str) and self.find_index(code) >= 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self.code_at(index)
+
+
+def parse_override_tab(path):
+    """
+    解析覆寫/黑名單檔，回傳 (取代表, 移除表)。
+      字根碼 詞1 詞2 ...   以這些詞取代該字根碼的整份候選清單
+      -字根碼 詞1 詞2 ...  從該字根碼的候選清單移除這些詞（黑名單）
+      -字根碼              整個移除該字根碼
+    """
+    replacements = {}
+    removals = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+
+            if parts[0].startswith("-") and len(parts[0]) > 1:
+                code = parts[0][1:]
+                if len(parts) == 1:
+                    removals[code] = None
+                elif removals.get(code, ()) is not None:
+                    removals.setdefault(code, set()).update(parts[1:])
+            elif len(parts) >= 2:
+                replacements[parts[0]] = parts[1:]
+    return replacements, removals
+
+
+def _dedupe(words):
+    """去除重複的候選詞，保留第一次出現的順序"""
+    return list(dict.fromkeys(words))
+
+
+class LayeredWordTable(Mapping):
+    """
+    多層詞庫：唯讀的系統詞庫 + 使用者詞庫 + 覆寫/黑名單層。
+
+    只有被上層影響到的字根碼會在建立時預先算好合併、去重後的候選清單，
+    查詢時先查這份小字典，沒有才查系統詞庫，因此成本與單一詞庫相同。
+    """
+
+    def __init__(self, system, user=None, replacements=None, removals=None):
+        self.system = system
+        user = user or {}
+        replacements = replacements or {}
+        removals = removals or {}
+
+        # 上層字根碼在系統詞庫中的候選詞；系統詞庫是詞庫服務時以一次批次查詢取得
+        codes = sorted(set(user) | set(replacements) | set(removals))
+        lookup_many = getattr(system, "lookup_many", None)
+        if lookup_many is not None:
+            system_words = dict(zip(codes, lookup_many(codes, vr_mode=False)))
+        else:
+            system_words = {code: system.get(code, []) for code in codes}
+
+        # 合併後的結果；空清單代表該字根碼已被移除
+        merged = {}
+        for code in codes:
+            if code in replacements:
+                words = _dedupe(replacements[code])
+            else:
+                words = _dedupe(system_words[code] + user.get(code, []))
+            removed = removals.get(code, ())
+            if removed is None:
+                words = []
+            elif removed:
+                words = [w for w in words if w not in removed]
+            merged[code] = words
+        self._merged = merged
+        self._overlay_codes = sorted(merged)
+
+        shown = sum(1 for words in merged.values() if words)
+        hidden = sum(1 for code in merged if system_words[code])
+        self._count = len(system) + shown - hidden
+
+    def close(self):
+        self.system.close()
+
+    def reverse_refs(self):
+        return self.system.reverse_refs()
+
+    @property
+    def selectors(self):
+        return self.system.selectors
+
+    def resolve_shortcode(self, shortcode):
+        """字根碼被上層改動時，依合併後的候選清單解析；否則交給系統詞庫的雜湊索引"""
+        base = shortcode[:-1]
+        words = self._merged.get(base)
+        if words is None:
+            return self.system.resolve_shortcode(shortcode)
+        position = self.selectors.get(shortcode[-1:].upper())
+        if position is None or len(base) < SELECTOR_MIN_CODE_LENGTH or position >= len(words):
+            return None
+        return words[position]
+
+    def reverse_entries(self, word):
+        """反查 word：系統詞庫中未被上層改動的字根碼，加上上層合併後的結果"""
+        entries = [(code, position) for code, position in self.system.reverse_entries(word)
+                   if code not in self._merged]
+        for code, words in self._merged.items():
+            for position, candidate in enumerate(words):
+                if candidate == word:
+                    entries.append((code, position))
+        return sorted(entries)
+
+    def get(self, code, default=None):
+        words = self._merged.get(code)
+        if words is None:
+            return self.system.get(code, default)
+        return words if words else default
+
+    def __getitem__(self, code):
+        words = self.get(code)
+        if words is None:
+            raise KeyError(code)
+        return words
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for code, _ in self.prefix_items(""):
+            yield code
+
+    def _overlay_range(self, prefix):
+        """以 prefix 開頭的上層字根碼在 _overlay_codes 中的區間"""
+        overlay = self._overlay_codes
+        return bisect_left(overlay, prefix), bisect_left(overlay, prefix + "\U0010ffff")
+
+    def wildcard_items(self, pattern, limit=50, scan_budget=50000):
+        """合併系統詞庫與上層字根碼的萬用字元查詢結果，依字根碼排序"""
+        if not _fixed_positions(pattern):
+            return []
+        matcher = wildcard_regex(pattern)
+        start, end = self._overlay_range(re.split(r"[?*]", pattern, maxsplit=1)[0])
+        matched = [code for code in self._overlay_codes[start:end] if matcher.fullmatch(code)]
+        overlay = [(code, self._merged[code]) for code in matched if self._merged[code]]
+        # 只有符合樣式的上層字根碼會遮蔽系統結果，每個最多一筆，多取這些筆數以補足數量
+        system = [(code, words) for code, words in
+                  self.system.wildcard_items(pattern, limit + len(matched), scan_budget)
+                  if code not in self._merged]
+        return sorted(system + overlay)[:limit]
+
+    def prefix_items(self, prefix, limit=None):
+        """合併系統詞庫與上層字根碼的區間掃描，依字根碼排序產生 (字根碼, 候選詞清單)"""
+        overlay = self._overlay_codes
+        i, end = self._overlay_range(prefix)
+        # 每個區間內的上層字根碼最多遮蔽一筆系統結果；系統詞庫可能是詞庫服務，回傳的是清單
+        system_limit = None if limit is None else limit + (end - i)
+        system_items = iter(self.system.prefix_items(prefix, system_limit))
+        system_item = next(system_items, None)
+        produced = 0
+        while limit is None or produced < limit:
+            code = overlay[i] if i < end else None
+            if code is not None and (system_item is None or code <= system_item[0]):
+                if system_item is not None and system_item[0] == code:
+                    system_item = next(system_items, None)
+                i += 1
+                words = self._merged[code]
+                if not words:
+                    continue
+                yield code, words
+            elif system_item is not None:
+                yield system_item
+                system_item = next(system_items, None)
+            else:
+                break
+            produced += 1
+
+
+def lookup_input_codes(table, word, vr_mode=True):
+    """
+    反查字或詞的輸入方式（不依賴介面，可直接在命令列或其他工具中呼叫）。
+    回傳 (字根碼清單, 候選簡碼清單)；簡碼只在不會被同名字根碼的完全匹配蓋掉時才列出。
+    """
+    entries = table.reverse_entries(word)
+    codes = [code for code, _ in entries]
+    shortcodes = []
+    if vr_mode:
+        for code, position in entries:
+            if len(code) < SELECTOR_MIN_CODE_LENGTH:
+                continue
+            for suffix, index in table.selectors.items():
+                if index != position:
+                    continue
+                for shortcode in (code + suffix.lower(), code + suffix):
+                    if shortcode not in table:
+                        shortcodes.append(shortcode)
+                        break
+    return codes, shortcodes